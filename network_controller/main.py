@@ -18,8 +18,12 @@ def main():
     print("\n\n{}  {}NETWORK {}Creating Mininet network{}\n\n".format(costants['net_emote'], costants['ansi_red'],costants['ansi_white'],costants['ansi_white']))
     network = Mininet(topology,controller=None,autoSetMacs=True,autoStaticArp=True)
 
-    #add the controller
-    network.addController("LoadBalancerController",ip=costants['controller_host'],port=costants['controller_port'],controller=RemoteController)
+    #add the controller, in clustered mode every switch is connected to all the controllers of the cluster
+    if costants['cluster_size'] > 1:
+        for member in range(costants['cluster_size']):
+            network.addController("LoadBalancerController{}".format(member),ip=costants['controller_host'],port=costants['controller_port'] + member,controller=RemoteController)
+    else:
+        network.addController("LoadBalancerController",ip=costants['controller_host'],port=costants['controller_port'],controller=RemoteController)
     #Start the network
     network.start()
     #Dump the connections
@@ -29,10 +33,14 @@ def main():
     #Create a network traffic object
     traffic_controller = NetworkTraffic(network,topology)
 
-    #Ping all the hosts to check the reachability
-    traffic_controller.ping_all()
+    if costants['fast_bring_up']:
+        #Announce every host once and start the traffic as soon as the controller knows all of them
+        traffic_controller.announce_hosts()
+    else:
+        #Ping all the hosts to check the reachability
+        traffic_controller.ping_all()
 
-    time.sleep(2)
+        time.sleep(2)
     #Generate traffic between all the hosts
     traffic_controller.generate_all_traffic()
 
@@ -51,6 +59,6 @@ if __name__ == "__main__":
         if utils.port_scan(costants['controller_host'],costants['controller_port']):
             break
         print("{}  {}WAIT {} Waiting for the controller to start{}".format(costants['important_emote'], costants['ansi_red'],costants['ansi_white'],costants['ansi_white']))
-        time.sleep(2)
+        time.sleep(0.1 if costants['fast_bring_up'] else 2)
     print("\n\n{}  {}WAIT {} Controller is up and running{}".format(costants['important_emote'], costants['ansi_green'],costants['ansi_white'],costants['ansi_white']))
     main()
\ No newline at end of file
@@ -36,6 +36,7 @@ class NetworkTopology(Topo):
         # Create switches
         self.my_switches = list()
         self.my_hosts = list()
+        created_hosts = set()   #Topo.hosts() sorts all the nodes on every call, the lookup must be constant time
 
         for switch in json_data['switches']:
             switch_id = str(switch['id'])
@@ -48,11 +49,12 @@ class NetworkTopology(Topo):
                 host_id = str(host['hostid'])
                 link_bw_h = int(host['bw'])
                 host_ip = str(host['ip'])
-                if host_id in self.hosts():
+                if host_id in created_hosts:
                     self.addLink(host_id, self.my_switches[-1], cls=TCLink, bw=link_bw_h)
                     continue
                 
                 host = self.addHost(host_id,cls=Host,ip=host_ip, defaultRoute = None)
+                created_hosts.add(host_id)
                 self.my_hosts.append(host)
                 print_debug("Creating host {} linked to switch: {}".format(host_id,switch_id))
                 self.addLink(host, self.my_switches[-1])
@@ -66,10 +68,10 @@ class NetworkTopology(Topo):
                 print_debug("Connecting switch {} to switch {}".format(switch_id, connected_switch_id))
                 self.addLink(switch_id, connected_switch_id, cls=TCLink, bw=link_bw_s)
 
-    # Load the JSON network topology file and validate it
+    # Load the JSON network topology file and validate it, in linear time in the number of switches, hosts and links
     def load_json(self):
-        json_file = open(self.json_path, 'r')
-        json_data = json.load(json_file)
+        with open(self.json_path, 'r') as json_file:
+            json_data = json.load(json_file)
 
         #validate json
         if 'switches' not in json_data or list(json_data.keys()) != ['switches']:
@@ -95,6 +97,12 @@ class NetworkTopology(Topo):
         for switch in json_data['switches']:
             for connected_switch in switch['connected_switches']:
                 link = (switch['id'], connected_switch['switchid'])
+                if link[1] not in switch_ids:
+                    print_error("The switch {} is connected to the unknown switch {}".format(link[0], link[1]))
+                    raise Exception('Unknown switch')
+                if link[0] == link[1]:
+                    print_error("The switch {} is connected to itself".format(link[0]))
+                    raise Exception('Invalid switch connection')
                 if link in links or (link[1], link[0]) in links:
                     print_error("The link between switch {} and switch {} is redundant".format(link[0], link[1]))
                     raise Exception('Redundant switch connections')
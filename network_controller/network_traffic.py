@@ -1,7 +1,12 @@
 from utils import costants, print_debug, print_error,get_file_path,bytes_to_kilobytes
 import json
+import csv
+import os
+import subprocess
+import time
+import threading
 import traceback
-from mininet.util import pmonitor
+import urllib.request
 
 '''
 {
@@ -14,10 +19,52 @@ from mininet.util import pmonitor
             "src_port: "port number"
             "dst_port: "port number"
             "data_sixze": "data size in bytes"
+            "start": "optional, seconds after the beginning of the traffic"
+            "duration": "optional, seconds of traffic (TCP/UDP), replaces data_size"
+            "repeat": "optional, number of times the flow is run, one after another"
         }
     ]
 }
 '''
+#Columns of the results table
+RESULT_FIELDS = ['flow', 'repeat', 'type', 'src_host', 'dst_host', 'src_port', 'dst_port', 'start', 'duration', 'bytes',
+                 'throughput_mbps', 'sender_mbps', 'retransmits', 'jitter_ms', 'lost_percent', 'error']
+
+#Extract the results of a flow from the output of iperf3 --json
+def parse_iperf_json(output, udp):
+    try:
+        data = json.loads(output)
+    except ValueError:
+        return {'error': 'invalid iperf3 output: {}'.format(output.strip()[:200])}
+    if 'error' in data:
+        return {'error': data['error']}
+
+    end = data['end']
+    if udp:
+        sent = end['sum']
+        #recent iperf3 versions report the receiver side separately
+        received = end.get('sum_received', sent)
+        return {
+            'duration': round(received['seconds'], 3),
+            'bytes': received['bytes'],
+            'throughput_mbps': round(received['bits_per_second'] / 1e6, 3),
+            'sender_mbps': round(sent['bits_per_second'] / 1e6, 3),
+            'jitter_ms': round(sent['jitter_ms'], 3),
+            'lost_percent': round(sent['lost_percent'], 3),
+            'error': None,
+        }
+    sent, received = end['sum_sent'], end['sum_received']
+    return {
+        'duration': round(received['seconds'], 3),
+        'bytes': received['bytes'],
+        'throughput_mbps': round(received['bits_per_second'] / 1e6, 3),
+        'sender_mbps': round(sent['bits_per_second'] / 1e6, 3),
+        'retransmits': sent.get('retransmits'),
+        'error': None,
+    }
+
+def _value(value, unit=''):
+    return '-' if value is None else '{}{}'.format(value, unit)
 
 class NetworkTraffic:
     def __init__(self, network_controller,topology):
@@ -25,7 +72,11 @@ class NetworkTraffic:
         self.topology = topology
         self.max_ping = 15
         self.ping_timeout = 0.2
-        self.popens = dict()
+        self.servers = dict()           #(host, port) -> iperf3 server process
+        self.server_locks = dict()      #(host, port) -> lock held by the flow that is using the server
+        self.server_startup_time = 1    #seconds
+        self.results = list()
+        self.results_lock = threading.Lock()
 
         #load traffic from json
         try:
@@ -61,64 +112,185 @@ class NetworkTraffic:
         print("\n\n{}  {}NETWORK TRAFFIC {} Not all the hosts are reachable{}\n\n".format(costants['ping_emote'], costants['ansi_red'],costants['ansi_white'],costants['ansi_white']))
         exit(1)
     
+    #Fast bring up: every host not yet known by the controller sends a single ping, all the hosts at the same time, so
+    #that the controller discovers it from the packet in. The controller is then asked which hosts it knows, until all
+    #the hosts are known or bring_up_timeout expires
+    def announce_hosts(self):
+        print("\n\n{}  {}NETWORK TRAFFIC {} Announcing the hosts to the controller{}\n\n".format(costants['ping_emote'], costants['ansi_red'],costants['ansi_white'],costants['ansi_white']))
+
+        hosts = self.network_controller.hosts
+        deadline = time.time() + costants['bring_up_timeout']
+        attempt = 0
+        while True:
+            known = self._known_hosts()
+            missing = [(index, host) for index, host in enumerate(hosts) if host.MAC() not in known]
+            if not missing:
+                print("\n\n{}  {}NETWORK TRAFFIC {} All {} hosts known by the controller after {} announce rounds{}\n\n".format(costants['ping_emote'], costants['ansi_green'],costants['ansi_white'],len(hosts),attempt,costants['ansi_white']))
+                return
+            if time.time() > deadline:
+                print_error("{} hosts are not known by the controller: {}".format(len(missing), ', '.join(host.name for _, host in missing)))
+                print_error("Be sure that the controller is running with --observe-links and that its REST API is reachable")
+                exit(1)
+
+            attempt += 1
+            print_debug("Announce round {}: {} hosts unknown".format(attempt, len(missing)))
+            #the destination does not matter (the controller learns the source host), the next host is used
+            processes = [host.popen(['ping', '-c', '1', '-W', '1', hosts[(index + 1) % len(hosts)].IP()]) for index, host in missing]
+            for process in processes:
+                process.communicate()
+
+    #Mac addresses of the hosts known by the controller, empty if the controller cannot be reached
+    def _known_hosts(self):
+        url = "http://{}:{}/hosts".format(costants['controller_host'], costants['controller_api_port'])
+        try:
+            with urllib.request.urlopen(url, timeout=2) as response:
+                return set(host['mac'] for host in json.load(response)['hosts'])
+        except (OSError, ValueError, KeyError) as e:
+            print_debug("Impossible to get the hosts from {}: {}".format(url, e))
+            return set()
+
     def generate_all_traffic(self):
         print("\n\n{}  {}NETWORK TRAFFIC {} Starting Network Traffic between all hosts{}\n\n".format(costants['ping_emote'], costants['ansi_red'],costants['ansi_white'],costants['ansi_white']))
 
-        for traffic in self.traffic:
-            if traffic['type'] == 'ARP':
-                self._generate_traffic(traffic['src_host'],traffic['dst_host'],traffic['type'],traffic['data_size'])
-            else:
-                self._generate_traffic(traffic['src_host'],traffic['dst_host'],traffic['type'],traffic['data_size'],src_port=traffic['src_port'],dst_port=traffic['dst_port'])
-
-        self.stdout_traffic = dict()
-        #show the traffic
-        for host, line in pmonitor(self.popens):
-            if host:
-                if host not in self.stdout_traffic:
-                    self.stdout_traffic[host] = line
-                else:
-                    self.stdout_traffic[host] += line
-            
-        for host, line in self.stdout_traffic.items():
-            print("\n\n{}  {}NETWORK TRAFFIC {} Traffic output for host: {}\n\n".format(costants['ping_emote'], costants['ansi_green'],costants['ansi_white'],host))
-            print(line)
+        self._start_servers()
+
+        #every flow runs in its own thread: it waits for its start offset and runs its repetitions one after another
+        self.results = list()
+        start_time = time.time()
+        threads = list()
+        for index, traffic in enumerate(self.traffic):
+            thread = threading.Thread(target=self._run_flow, args=(index, traffic, start_time), daemon=True)
+            thread.start()
+            threads.append(thread)
+        for thread in threads:
+            thread.join()
+
+        self._stop_servers()
+        self.results.sort(key=lambda result: (result['flow'], result['repeat']))
+        self._print_results()
+        self._write_results()
 
         print("\n\n{}  {}NETWORK TRAFFIC {} Network Traffic between all hosts completed\n\n".format(costants['ping_emote'], costants['ansi_green'],costants['ansi_white']))
 
-    def _generate_traffic(self,host_src,host_dst,traffic_type,data_size,src_port=0,dst_port=0):
-        print("{}  {}Traffic {} Generating Traffic from {} to {}".format(costants['ping_emote'], costants['ansi_red'],costants['ansi_white'],host_src,host_dst))
+    #One iperf3 server for every (host, port) used by the flows
+    def _start_servers(self):
+        for traffic in self.traffic:
+            if traffic['type'] == 'ARP':
+                continue
+            key = (traffic['dst_host'], traffic['dst_port'])
+            if key in self.servers:
+                continue
+            host_dst = self._get_host(traffic['dst_host'])
+            print_debug("Starting iperf3 server on {}:{}".format(host_dst, traffic['dst_port']))
+            #the reports of the server are not read (the client reports are used), a pipe would fill up and block the server
+            self.servers[key] = host_dst.popen(['iperf3', '-s', '-p', str(traffic['dst_port'])], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+            self.server_locks[key] = threading.Lock()
+        #let the servers start listening
+        if self.servers:
+            time.sleep(self.server_startup_time)
 
-        try:
-            host_src = self.network_controller.get(host_src)
-        except Exception as e:
-            print_error("Impossible to get the host {}".format(host_src))
-            print_error("Exiting...")
-            exit(1)
+    def _stop_servers(self):
+        for server in self.servers.values():
+            server.terminate()
+            server.wait()
+        self.servers = dict()
+        self.server_locks = dict()
 
+    def _get_host(self, name):
         try:
-            host_dst = self.network_controller.get(host_dst)
+            return self.network_controller.get(name)
         except Exception as e:
-            print_error("Impossible to get the host {}".format(host_dst))
+            print_error("Impossible to get the host {}".format(name))
             print_error("Exiting...")
             exit(1)
 
-        if traffic_type == 'TCP':
-            #h2 should be listen on port dst_port
+    def _run_flow(self, index, traffic, start_time):
+        delay = start_time + traffic.get('start', 0) - time.time()
+        if delay > 0:
+            time.sleep(delay)
 
-            host_dst.popen("iperf3 -s -p {} &".format(dst_port))
-            #h1 should send data to h2 sending data_size bytes
-            data = bytes_to_kilobytes(int(data_size))
-            self.popens["TCP {}:{} -> {}:{}".format(host_src,src_port,host_dst,dst_port)] = host_src.popen("iperf3 -c {} -p {} -n {}k -B {} --cport {} &".format(host_dst.IP(),dst_port,data,host_src.IP(),src_port))
-        elif traffic_type == 'UDP':
-            #h2 should be listen on port dst_port
-            host_dst.popen("iperf3 -s -p {} &".format(dst_port))
-            #h1 should send data to h2 sending data_size bytes
-            data = bytes_to_kilobytes(int(data_size))
-            self.popens["UDP {}:{} -> {}:{}".format(host_src,src_port,host_dst,dst_port)] = host_src.popen("iperf3 -c {} -p {} -n {}k -u -B {} --cport {} &".format(host_dst.IP(),dst_port,data,host_src.IP(),src_port))
+        for repeat in range(traffic.get('repeat', 1)):
+            print("{}  {}Traffic {} Generating Traffic from {} to {} ({}/{})".format(costants['ping_emote'], costants['ansi_red'],costants['ansi_white'],traffic['src_host'],traffic['dst_host'],repeat+1,traffic.get('repeat', 1)))
+            started_at = time.time() - start_time
+            if traffic['type'] == 'ARP':
+                result = self._run_arp(traffic)
+            else:
+                #an iperf3 server runs one test at a time, the flows toward the same server wait for their turn
+                with self.server_locks[(traffic['dst_host'], traffic['dst_port'])]:
+                    started_at = time.time() - start_time
+                    result = self._run_iperf(traffic)
+
+            row = dict.fromkeys(RESULT_FIELDS)
+            row.update({
+                'flow': index,
+                'repeat': repeat,
+                'type': traffic['type'],
+                'src_host': traffic['src_host'],
+                'dst_host': traffic['dst_host'],
+                'src_port': traffic.get('src_port'),
+                'dst_port': traffic.get('dst_port'),
+                'start': round(started_at, 3),
+            })
+            row.update(result)
+            with self.results_lock:
+                self.results.append(row)
+
+            if row['error'] is not None:
+                print_error("Flow {} from {} to {} failed: {}".format(index, traffic['src_host'], traffic['dst_host'], row['error']))
+            else:
+                print("{}  {}Traffic {} Traffic generated from {} to {}{}".format(costants['ping_emote'], costants['ansi_green'],costants['ansi_white'],traffic['src_host'],traffic['dst_host'],costants['ansi_white']))
+
+    def _run_iperf(self, traffic):
+        host_src = self._get_host(traffic['src_host'])
+        host_dst = self._get_host(traffic['dst_host'])
+
+        command = ['iperf3', '-c', host_dst.IP(), '-p', str(traffic['dst_port']), '-B', host_src.IP(), '--cport', str(traffic['src_port']), '--json']
+        if 'duration' in traffic:
+            command += ['-t', str(traffic['duration'])]
         else:
-            self.popens["{} ARP {}".format(host_src,host_dst)] = host_src.popen("arping -C {} {}".format(data_size,host_dst.IP()))
+            #h1 should send data to h2 sending data_size bytes
+            command += ['-n', '{}k'.format(bytes_to_kilobytes(int(traffic['data_size'])))]
+        if traffic['type'] == 'UDP':
+            command.append('-u')
+
+        output, _ = host_src.popen(command).communicate()
+        return parse_iperf_json(output.decode(errors='replace') if isinstance(output, bytes) else output, traffic['type'] == 'UDP')
+
+    def _run_arp(self, traffic):
+        host_src = self._get_host(traffic['src_host'])
+        host_dst = self._get_host(traffic['dst_host'])
+        begin = time.time()
+        process = host_src.popen(['arping', '-C', str(traffic['data_size']), host_dst.IP()])
+        process.communicate()
+        error = None if process.returncode == 0 else 'arping exit code {}'.format(process.returncode)
+        return {'duration': round(time.time() - begin, 3), 'error': error}
+
+    def _print_results(self):
+        print("\n\n{}  {}NETWORK TRAFFIC {} Results{}\n".format(costants['ping_emote'], costants['ansi_green'],costants['ansi_white'],costants['ansi_white']))
+        print("{:>4} {:>3} {:<4} {:>16} {:>16} {:>9} {:>9} {:>14} {:>12} {:>10} {:>8}".format(
+            'flow', 'rep', 'type', 'source', 'destination', 'start', 'duration', 'throughput', 'retransmits', 'jitter', 'lost'))
+        for row in self.results:
+            if row['error'] is not None:
+                print("{:>4} {:>3} {:<4} {:>16} {:>16} {:>9} error: {}".format(row['flow'], row['repeat'], row['type'],
+                    "{}:{}".format(row['src_host'], row['src_port'] or ''), "{}:{}".format(row['dst_host'], row['dst_port'] or ''), row['start'], row['error']))
+                continue
+            print("{:>4} {:>3} {:<4} {:>16} {:>16} {:>9} {:>9} {:>14} {:>12} {:>10} {:>8}".format(row['flow'], row['repeat'], row['type'],
+                "{}:{}".format(row['src_host'], row['src_port'] or ''), "{}:{}".format(row['dst_host'], row['dst_port'] or ''), row['start'], _value(row['duration']),
+                _value(row['throughput_mbps'], ' Mbps'), _value(row['retransmits']), _value(row['jitter_ms'], ' ms'), _value(row['lost_percent'], '%')))
+
+    #The results are written to <traffic_results_folder>/<topology>_<date>.json and .csv
+    def _write_results(self):
+        folder = get_file_path(__file__, "../{}".format(costants['traffic_results_folder']))
+        os.makedirs(folder, exist_ok=True)
+        name = "{}_{}".format(costants['topology_folder_location'], time.strftime('%Y%m%d-%H%M%S'))
 
-        print("{}  {}Traffic {} Traffic generated from {} to {}{}".format(costants['ping_emote'], costants['ansi_green'],costants['ansi_white'],host_src,host_dst,costants['ansi_white']))
+        with open(os.path.join(folder, name + '.json'), 'w') as file:
+            json.dump({'topology': costants['topology_folder_location'], 'results': self.results}, file, indent=4)
+        with open(os.path.join(folder, name + '.csv'), 'w', newline='') as file:
+            writer = csv.DictWriter(file, fieldnames=RESULT_FIELDS)
+            writer.writeheader()
+            writer.writerows(self.results)
+        print("{}  {}NETWORK TRAFFIC {} Results written to {}{}{}".format(costants['ping_emote'], costants['ansi_green'],costants['ansi_white'],costants['ansi_blue'],os.path.join(folder, name + '.{json,csv}'),costants['ansi_white']))
     
     def load_json(self, path):
         json_file = open(path,'r')
@@ -130,10 +302,11 @@ class NetworkTraffic:
             print_error("Invalid JSON file: 'traffic' key not found or extra keys found")
             raise Exception('Invalid JSON file')
         
+        hosts = set(self.topology.hosts())
         for traffic in json_data['traffic']:    #check if all keys are valid
             keys = traffic.keys()
             for key in keys:
-                if key not in ['type', 'src_host', 'dst_host', 'src_port', 'dst_port', 'data_size']:
+                if key not in ['type', 'src_host', 'dst_host', 'src_port', 'dst_port', 'data_size', 'start', 'duration', 'repeat']:
                     print_error("Invalid JSON file: invalid key found: {} should not be here".format(key))
                     raise Exception('Invalid JSON file')
                 
@@ -141,11 +314,11 @@ class NetworkTraffic:
                     print_error("Invalid JSON file: invalid traffic type: {}".format(traffic['type']))
                     raise Exception('Invalid JSON file')
                 
-                if traffic['src_host'] not in self.topology.hosts():
+                if traffic['src_host'] not in hosts:
                     print_error("Invalid JSON file: invalid source host: {}".format(traffic['src_host']))
                     raise Exception('Invalid JSON file')
                 
-                if traffic['dst_host'] not in self.topology.hosts():
+                if traffic['dst_host'] not in hosts:
                     print_error("Invalid JSON file: invalid destination host: {}".format(traffic['dst_host']))
                     raise Exception('Invalid JSON file')
                 
@@ -154,9 +327,38 @@ class NetworkTraffic:
                         print_error("Invalid JSON file: ARP traffic should not have port numbers")
                         raise Exception('Invalid JSON file')
 
+                    if 'duration' in traffic:
+                        print_error("Invalid JSON file: ARP traffic should not have a duration, data_size is the number of packets")
+                        raise Exception('Invalid JSON file')
+
+                #TCP/UDP flows send data_size bytes or run for duration seconds
+                if 'data_size' not in traffic and 'duration' not in traffic:
+                    print_error("Invalid JSON file: data_size or duration required")
+                    raise Exception('Invalid JSON file')
+
                 #check that data size is a positive integer
-                if int(traffic['data_size']) <= 0:
+                if 'data_size' in traffic and int(traffic['data_size']) <= 0:
                     print_error("Invalid JSON file: invalid data_size: {}".format(traffic['data_size']))
                     raise Exception('Invalid JSON file')
+
+                #the numbers are stored converted, the flow threads use them as they are
+                if 'duration' in traffic:
+                    traffic['duration'] = float(traffic['duration'])
+                if 'start' in traffic:
+                    traffic['start'] = float(traffic['start'])
+                if 'repeat' in traffic:
+                    traffic['repeat'] = int(traffic['repeat'])
+
+                if 'duration' in traffic and traffic['duration'] <= 0:
+                    print_error("Invalid JSON file: invalid duration: {}".format(traffic['duration']))
+                    raise Exception('Invalid JSON file')
+
+                if 'start' in traffic and traffic['start'] < 0:
+                    print_error("Invalid JSON file: invalid start: {}".format(traffic['start']))
+                    raise Exception('Invalid JSON file')
+
+                if 'repeat' in traffic and traffic['repeat'] < 1:
+                    print_error("Invalid JSON file: invalid repeat: {}".format(traffic['repeat']))
+                    raise Exception('Invalid JSON file')
         
         self.traffic = json_data['traffic']
\ No newline at end of file
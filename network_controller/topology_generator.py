@@ -0,0 +1,186 @@
+import argparse
+import json
+import os
+import random
+import networkx as nx
+import utils
+from utils import costants, print_error
+
+'''
+    Topology generator: writes a topology folder (switches.json and traffic.json) in the config folder.
+
+    Available topologies:
+    - fat_tree: k-ary fat tree, (k/2)^2 core switches, k pods of k/2 aggregation and k/2 edge switches, k/2 hosts per edge switch
+    - leaf_spine: every leaf switch is connected to every spine switch, the hosts are connected to the leaves
+    - jellyfish: random regular graph of switches with the given degree, the hosts are connected to every switch
+    - torus: 2D torus of switches, the hosts are connected to every switch
+
+    The traffic is a random permutation: every host sends one TCP or UDP flow to another host.
+
+    Usage: python3 network_controller/topology_generator.py fat_tree --k 4 --name fat_tree_4
+'''
+
+class TopologyBuilder:
+    def __init__(self, host_bw, link_bw):
+        self.host_bw = host_bw
+        self.link_bw = link_bw
+        self.switches = list()      #switch entries of switches.json
+        self.index = dict()         #switch id -> switch entry
+        self.hosts = list()         #host ids
+
+    def add_switch(self):
+        switch_id = "S{}".format(len(self.switches) + 1)
+        switch = {'id': switch_id, 'hosts': [], 'connected_switches': []}
+        self.switches.append(switch)
+        self.index[switch_id] = switch
+        return switch_id
+
+    def add_host(self, switch_id):
+        number = len(self.hosts) + 1
+        host_id = "H{}".format(number)
+        #10.0.0.0/8 network, enough for 2^24 - 2 hosts
+        ip = "10.{}.{}.{}".format((number >> 16) & 0xff, (number >> 8) & 0xff, number & 0xff)
+        self.index[switch_id]['hosts'].append({'hostid': host_id, 'ip': ip, 'bw': self.host_bw})
+        self.hosts.append(host_id)
+        return host_id
+
+    #A link is listed only once, on the first switch
+    def add_link(self, src, dst):
+        self.index[src]['connected_switches'].append({'switchid': dst, 'bw': self.link_bw})
+
+def fat_tree(builder, k):
+    if k < 2 or k % 2 != 0:
+        raise Exception('k must be an even number greater than 0')
+    half = k // 2
+    core = [builder.add_switch() for _ in range(half * half)]
+    for pod in range(k):
+        aggregation = [builder.add_switch() for _ in range(half)]
+        edge = [builder.add_switch() for _ in range(half)]
+        for i, aggregation_switch in enumerate(aggregation):
+            #the i-th aggregation switch of every pod is connected to the i-th group of core switches
+            for core_switch in core[i * half:(i + 1) * half]:
+                builder.add_link(core_switch, aggregation_switch)
+            for edge_switch in edge:
+                builder.add_link(aggregation_switch, edge_switch)
+        for edge_switch in edge:
+            for _ in range(half):
+                builder.add_host(edge_switch)
+
+def leaf_spine(builder, leaves, spines, hosts_per_switch):
+    spine = [builder.add_switch() for _ in range(spines)]
+    for _ in range(leaves):
+        leaf = builder.add_switch()
+        for spine_switch in spine:
+            builder.add_link(spine_switch, leaf)
+        for _ in range(hosts_per_switch):
+            builder.add_host(leaf)
+
+def jellyfish(builder, switches, degree, hosts_per_switch, seed):
+    if switches * degree % 2 != 0 or degree >= switches:
+        raise Exception('switches * degree must be even and degree lower than switches')
+    rng = random.Random(seed)
+    #a random regular graph may be disconnected, a new one is drawn until it is connected
+    while True:
+        graph = nx.random_regular_graph(degree, switches, seed=rng.randint(0, 2**32 - 1))
+        if nx.is_connected(graph):
+            break
+    ids = [builder.add_switch() for _ in range(switches)]
+    for src, dst in graph.edges():
+        builder.add_link(ids[src], ids[dst])
+    for switch_id in ids:
+        for _ in range(hosts_per_switch):
+            builder.add_host(switch_id)
+
+def torus(builder, rows, columns, hosts_per_switch):
+    if rows < 1 or columns < 1:
+        raise Exception('rows and columns must be positive')
+    ids = [[builder.add_switch() for _ in range(columns)] for _ in range(rows)]
+    links = set()
+    for row in range(rows):
+        for column in range(columns):
+            for neighbor in (ids[row][(column + 1) % columns], ids[(row + 1) % rows][column]):
+                link = frozenset((ids[row][column], neighbor))
+                #with 1 or 2 switches in a dimension the wrap around link is a self loop or a duplicate
+                if len(link) == 2 and link not in links:
+                    links.add(link)
+                    builder.add_link(ids[row][column], neighbor)
+    for row in ids:
+        for switch_id in row:
+            for _ in range(hosts_per_switch):
+                builder.add_host(switch_id)
+
+#Random permutation traffic: every host sends one flow to a different host
+def permutation_traffic(hosts, data_size, seed):
+    rng = random.Random(seed)
+    destinations = list(hosts)
+    if len(hosts) < 2:
+        return []
+    #random derangement: no host sends traffic to itself
+    while True:
+        rng.shuffle(destinations)
+        if all(src != dst for src, dst in zip(hosts, destinations)):
+            break
+    traffic = list()
+    for i, (src, dst) in enumerate(zip(hosts, destinations)):
+        traffic.append({
+            'type': 'TCP' if i % 2 == 0 else 'UDP',
+            'src_host': src,
+            'dst_host': dst,
+            'src_port': 10000 + i % 50000,
+            'dst_port': 5201 + i % 50000,
+            'data_size': data_size
+        })
+    return traffic
+
+def write_topology(builder, name, traffic):
+    folder = utils.get_file_path(__file__, "../config/{}".format(name))
+    os.makedirs(folder, exist_ok=True)
+    with open(os.path.join(folder, 'switches.json'), 'w') as file:
+        json.dump({'switches': builder.switches}, file, indent=4)
+    with open(os.path.join(folder, 'traffic.json'), 'w') as file:
+        json.dump({'traffic': traffic}, file, indent=4)
+    return folder
+
+def main():
+    parser = argparse.ArgumentParser(description='Generate a topology folder in the config folder')
+    parser.add_argument('topology', choices=['fat_tree', 'leaf_spine', 'jellyfish', 'torus'])
+    parser.add_argument('--name', help='name of the topology folder (default: the topology type and its size)')
+    parser.add_argument('--k', type=int, default=4, help='fat_tree: number of ports of the switches')
+    parser.add_argument('--leaves', type=int, default=8, help='leaf_spine: number of leaf switches')
+    parser.add_argument('--spines', type=int, default=4, help='leaf_spine: number of spine switches')
+    parser.add_argument('--switches', type=int, default=16, help='jellyfish: number of switches')
+    parser.add_argument('--degree', type=int, default=4, help='jellyfish: number of links of every switch')
+    parser.add_argument('--rows', type=int, default=4, help='torus: number of rows')
+    parser.add_argument('--columns', type=int, default=4, help='torus: number of columns')
+    parser.add_argument('--hosts-per-switch', type=int, default=2, help='leaf_spine, jellyfish, torus: hosts connected to every (leaf) switch')
+    parser.add_argument('--link-bw', type=int, default=100, help='bandwidth of the links between switches in Mbps')
+    parser.add_argument('--host-bw', type=int, default=1000, help='bandwidth of the links of the hosts in Mbps')
+    parser.add_argument('--data-size', type=int, default=1000000, help='bytes sent by every flow')
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    builder = TopologyBuilder(args.host_bw, args.link_bw)
+    try:
+        if args.topology == 'fat_tree':
+            fat_tree(builder, args.k)
+            name = args.name or "fat_tree_{}".format(args.k)
+        elif args.topology == 'leaf_spine':
+            leaf_spine(builder, args.leaves, args.spines, args.hosts_per_switch)
+            name = args.name or "leaf_spine_{}x{}".format(args.leaves, args.spines)
+        elif args.topology == 'jellyfish':
+            jellyfish(builder, args.switches, args.degree, args.hosts_per_switch, args.seed)
+            name = args.name or "jellyfish_{}_{}".format(args.switches, args.degree)
+        else:
+            torus(builder, args.rows, args.columns, args.hosts_per_switch)
+            name = args.name or "torus_{}x{}".format(args.rows, args.columns)
+    except Exception as e:
+        print_error("Impossible to generate the topology: {}".format(e))
+        exit(1)
+
+    folder = write_topology(builder, name, permutation_traffic(builder.hosts, args.data_size, args.seed))
+    print("{}  {}TOPOLOGY GENERATOR {}{} switches, {} hosts written to {}{}{}".format(costants['net_emote'], costants['ansi_green'], costants['ansi_white'],
+        len(builder.switches), len(builder.hosts), costants['ansi_blue'], folder, costants['ansi_white']))
+    print("Set \"topology_folder_location\": \"{}\" in config/constants.json to use it".format(name))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,98 @@
+'''
+    Non-blocking logging for the controller.
+
+    Writing to the console or to the log file blocks the event loop that handles the packet in messages. The log
+    records are instead put in a bounded queue and written by a separate thread (ryu-manager does not patch the
+    threading module, so it is a real thread). When the queue is full the records are dropped and counted, the
+    handlers never wait.
+    The messages are formatted only by the writer thread: str.format messages are wrapped in LazyFormat, the
+    arguments must not be modified after the call (numbers, strings, tuples).
+    The messages of the packet in path go to a sampled channel, that logs one message every sample_rate calls.
+'''
+import logging
+import threading
+import queue
+import atexit
+
+#Message formatted with str.format when the record is written
+class LazyFormat:
+    __slots__ = ('fmt', 'args', 'prefix', 'suffix')
+
+    def __init__(self, fmt, args=(), prefix='', suffix=''):
+        self.fmt = fmt
+        self.args = args
+        self.prefix = prefix
+        self.suffix = suffix
+
+    def __str__(self):
+        message = self.fmt.format(*self.args) if self.args else str(self.fmt)
+        return self.prefix + message + self.suffix
+
+class AsyncLogSink:
+    def __init__(self, size):
+        self.queue = queue.Queue(size)
+        self.handlers = list()      #handlers that write the records, used only by the writer thread
+        self.dropped = 0            #records dropped because the queue was full
+        self.thread = None
+
+    def add_handler(self, handler):
+        #the list is replaced, the writer thread never sees a partially updated list
+        self.handlers = self.handlers + [handler]
+        if self.thread is None:
+            self.thread = threading.Thread(target=self._run, name='log-sink', daemon=True)
+            self.thread.start()
+            #the messages still in the queue are written before the process exits
+            atexit.register(self.queue.join)
+
+    #The records already queued are written before the handler is removed and closed
+    def remove_handler(self, handler):
+        if self.thread is not None:
+            self.queue.join()
+        self.handlers = [h for h in self.handlers if h is not handler]
+        handler.close()
+
+    def put(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def _run(self):
+        while True:
+            record = self.queue.get()
+            for handler in self.handlers:
+                if record.levelno >= handler.level:
+                    try:
+                        handler.handle(record)
+                    except Exception:
+                        handler.handleError(record)
+            self.queue.task_done()
+
+#Logging handler that forwards the records to the sink without formatting them
+class SinkHandler(logging.Handler):
+    def __init__(self, sink):
+        super(SinkHandler, self).__init__()
+        self.sink = sink
+
+    def emit(self, record):
+        self.sink.put(record)
+
+#Debug channel that logs one message every sample_rate calls
+class SampledLogger:
+    __slots__ = ('logger', 'sample_rate', 'count', 'prefix', 'suffix')
+
+    def __init__(self, logger, sample_rate, prefix='', suffix=''):
+        self.logger = logger
+        self.sample_rate = max(1, sample_rate)
+        self.count = 0
+        self.prefix = prefix
+        self.suffix = suffix
+
+    def debug(self, fmt, *args):
+        if not self.logger.isEnabledFor(logging.DEBUG):
+            return
+        self.count += 1
+        if self.count < self.sample_rate:
+            return
+        self.count = 0
+        self.logger.debug(LazyFormat(fmt, args, self.prefix, self.suffix))
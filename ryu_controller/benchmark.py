@@ -0,0 +1,286 @@
+'''
+    Offline benchmark of the packet in handling of the controller.
+
+    The controller is created without ryu-manager, Mininet and OVS: the switches are stub datapaths that discard the
+    messages (the messages are still built and serialized by the real OpenFlow parser), the topology API returns the
+    stub datapaths and the topology events are built from the switches.json file of a topology folder.
+    Synthetic packet in events are fed to the handlers: the first packet of new TCP/UDP connections, packets of known
+    connections reaching the next switch of their path (repeat hops) and ARP requests. The barrier requests are
+    answered immediately.
+    For every topology and cost protocol the benchmark reports the packet ins per second, the p50/p99 latency of the
+    packet in handler and the memory allocated by the controller during the run, in a json file.
+
+    Usage: python3 ryu_controller/benchmark.py [--topology ring_topology ...] [--protocol HOP ...] [--packets N] [--output file]
+'''
+import argparse
+import glob
+import json
+import logging
+import math
+import os
+import platform
+import random
+import time
+import tracemalloc
+from types import SimpleNamespace
+
+from ryu.controller import ofp_event
+from ryu.ofproto import ofproto_v1_3, ofproto_v1_3_parser
+from ryu.lib.packet import packet, ethernet, ether_types, ipv4, tcp, udp, arp, in_proto
+from utils import get_file_path, costants, log_sink
+from metrics import registry
+import main
+
+PROTOCOLS = ['HOP', 'OSPF', 'DYNAMIC_BANDWIDTH']
+
+class StubDatapath:
+    def __init__(self, dpid):
+        self.id = dpid
+        self.ofproto = ofproto_v1_3
+        self.ofproto_parser = ofproto_v1_3_parser
+        self.xid = 0
+        self.messages = 0
+        self.bytes = 0
+
+    def set_xid(self, msg):
+        self.xid = (self.xid + 1) & 0xffffffff
+        msg.set_xid(self.xid)
+        return self.xid
+
+    def send(self, buf):
+        self.bytes += len(buf)
+
+    def send_msg(self, msg):
+        if msg.xid is None:
+            self.set_xid(msg)
+        msg.serialize()
+        self.messages += 1
+        self.send(msg.buf)
+
+class StubWSGI:
+    def register(self, controller, data=None):
+        pass
+
+#Switches, links and hosts of a topology folder, with the port numbers assigned in the order of the file
+class Topology:
+    def __init__(self, folder):
+        self.folder = folder
+        self.datapaths = dict()     #dpid -> StubDatapath
+        self.links = list()         #(src dpid, src port, dst dpid, dst port), both directions
+        self.hosts = list()         #(mac, ip, dpid, port)
+        self.host_names = dict()    #host id -> (mac, ip, dpid, port)
+        self.bandwidth = dict()     #(src dpid, dst dpid) -> nominal bandwidth of the link in bits per second
+        self.host_bandwidth = dict()    #host mac -> nominal bandwidth of the link of the host in bits per second
+        next_port = dict()
+
+        def port(dpid):
+            next_port[dpid] = next_port.get(dpid, 0) + 1
+            return next_port[dpid]
+
+        with open(get_file_path(__file__, "../config/{}/switches.json".format(folder)), 'r') as file:
+            switches = json.load(file)['switches']
+        for switch in switches:
+            dpid = int(str(switch['id'])[1:])
+            self.datapaths[dpid] = StubDatapath(dpid)
+        for switch in switches:
+            dpid = int(str(switch['id'])[1:])
+            for host in switch['hosts']:
+                host_id = int(str(host['hostid'])[1:])
+                mac = ':'.join('{:02x}'.format((host_id >> shift) & 0xff) for shift in range(40, -8, -8))
+                self.hosts.append((mac, host['ip'], dpid, port(dpid)))
+                self.host_names[str(host['hostid'])] = self.hosts[-1]
+                self.host_bandwidth[mac] = int(host['bw']) * 1000000
+            for connected_switch in switch['connected_switches']:
+                peer = int(str(connected_switch['switchid'])[1:])
+                src_port, dst_port = port(dpid), port(peer)
+                self.links.append((dpid, src_port, peer, dst_port))
+                self.links.append((peer, dst_port, dpid, src_port))
+                self.bandwidth[(dpid, peer)] = self.bandwidth[(peer, dpid)] = int(connected_switch['bw']) * 1000000
+
+    def get_switch(self, app, dpid=None):
+        if dpid is None:
+            return [SimpleNamespace(dp=datapath) for datapath in self.datapaths.values()]
+        datapath = self.datapaths.get(dpid)
+        return [] if datapath is None else [SimpleNamespace(dp=datapath)]
+
+def _packet_in(datapath, in_port, data):
+    parser = datapath.ofproto_parser
+    msg = parser.OFPPacketIn(datapath, buffer_id=ofproto_v1_3.OFP_NO_BUFFER, total_len=len(data),
+                             reason=ofproto_v1_3.OFPR_NO_MATCH, table_id=0, cookie=0,
+                             match=parser.OFPMatch(in_port=in_port), data=data)
+    return ofp_event.EventOFPPacketIn(msg)
+
+def _l4_packet(src, dst, proto, src_port, dst_port):
+    pkt = packet.Packet()
+    pkt.add_protocol(ethernet.ethernet(dst=dst[0], src=src[0], ethertype=ether_types.ETH_TYPE_IP))
+    pkt.add_protocol(ipv4.ipv4(src=src[1], dst=dst[1], proto=proto))
+    if proto == in_proto.IPPROTO_TCP:
+        pkt.add_protocol(tcp.tcp(src_port=src_port, dst_port=dst_port))
+    else:
+        pkt.add_protocol(udp.udp(src_port=src_port, dst_port=dst_port))
+    pkt.serialize()
+    return bytes(pkt.data)
+
+def _arp_request(src, dst):
+    pkt = packet.Packet()
+    pkt.add_protocol(ethernet.ethernet(dst='ff:ff:ff:ff:ff:ff', src=src[0], ethertype=ether_types.ETH_TYPE_ARP))
+    pkt.add_protocol(arp.arp(opcode=arp.ARP_REQUEST, src_mac=src[0], src_ip=src[1], dst_mac='00:00:00:00:00:00', dst_ip=dst[1]))
+    pkt.serialize()
+    return bytes(pkt.data)
+
+#Packets of the workload: (kind, src host, dst host, protocol, ports), the same for every cost protocol
+def workload(topology, packets, seed):
+    rng = random.Random(seed)
+    hosts = topology.hosts
+    items = list()
+    used = set()
+    while len(items) < packets:
+        src, dst = rng.sample(hosts, 2)
+        if len(items) % 10 == 9:
+            items.append(('arp', src, dst, None, None))
+            continue
+        proto = in_proto.IPPROTO_TCP if rng.random() < 0.5 else in_proto.IPPROTO_UDP
+        ports = (rng.randint(1024, 65535), rng.choice([80, 443, 5001, 8080]))
+        if (src, dst, proto, ports) in used:
+            continue
+        used.add((src, dst, proto, ports))
+        items.append(('new', src, dst, proto, ports))
+    return items
+
+def create_controller(topology, protocol):
+    costants['cost_protocol'] = protocol
+    costants['topology_folder_location'] = topology.folder
+    #the nominal bandwidth of the links is taken from the topology file, as in debug mode
+    costants['debug'] = True
+    costants['forwarding_mode'] = 'CONTROLLER'
+    costants['elephant_rerouting'] = False
+    main.get_switch = topology.get_switch
+
+    controller = main.RyuController(wsgi=StubWSGI())
+    logging.getLogger().setLevel(logging.WARNING)
+    logging.getLogger('console').setLevel(logging.WARNING)
+    controller.logger.setLevel(logging.WARNING)
+
+    for datapath in topology.datapaths.values():
+        controller.switch_enter_handler(SimpleNamespace(switch=SimpleNamespace(dp=datapath)))
+    for src, src_port, dst, dst_port in topology.links:
+        link = SimpleNamespace(src=SimpleNamespace(dpid=src, port_no=src_port), dst=SimpleNamespace(dpid=dst, port_no=dst_port))
+        controller.link_add_handler(SimpleNamespace(link=link))
+    for mac, ip, dpid, port in topology.hosts:
+        host = SimpleNamespace(mac=mac, ipv4=[ip], port=SimpleNamespace(dpid=dpid, port_no=port))
+        controller.host_add_handler(SimpleNamespace(host=host))
+    return controller
+
+#Unregister the metrics collector and the log file handler of a controller, so the next runs do not pay for them
+def release_controller(controller):
+    registry.remove_collector(controller.metrics_gauges)
+    log_sink.remove_handler(controller.log_handler)
+
+#The switches answer the barrier requests immediately
+def answer_barriers(controller, topology):
+    while controller.dispatcher.barriers:
+        for dpid, xid in list(controller.dispatcher.barriers.keys()):
+            datapath = topology.datapaths[dpid]
+            reply = datapath.ofproto_parser.OFPBarrierReply(datapath)
+            reply.xid = xid
+            controller.barrier_reply_handler(ofp_event.EventOFPBarrierReply(reply))
+
+def run(topology, protocol, items, measure_memory=False):
+    controller = create_controller(topology, protocol)
+    latencies = list()
+    elapsed = 0.0
+
+    if measure_memory:
+        tracemalloc.start()
+    memory_start = tracemalloc.get_traced_memory()[0] if measure_memory else 0
+
+    for kind, src, dst, proto, ports in items:
+        datapath = topology.datapaths[src[2]]
+        if kind == 'arp':
+            events = [_packet_in(datapath, src[3], _arp_request(src, dst))]
+        else:
+            data = _l4_packet(src, dst, proto, ports[0], ports[1])
+            events = [_packet_in(datapath, src[3], data)]
+        for ev in events:
+            start = time.perf_counter()
+            controller.packet_in_handler(ev)
+            latency = time.perf_counter() - start
+            latencies.append(latency)
+            elapsed += latency
+        answer_barriers(controller, topology)
+
+        #repeat hop: the packet reaches the next switch of the path before its rule is installed
+        if kind == 'new':
+            connection, reverse = controller.connections.find(*controller._rule_fields(proto, src[1], dst[1], ports[0], ports[1]))
+            if connection is not None and len(connection.path) > 1:
+                hop = connection.path[1]
+                in_port = controller.net[hop][connection.path[0]]['port']
+                start = time.perf_counter()
+                controller.packet_in_handler(_packet_in(topology.datapaths[hop], in_port, data))
+                latency = time.perf_counter() - start
+                latencies.append(latency)
+                elapsed += latency
+                answer_barriers(controller, topology)
+
+    memory = dict()
+    if measure_memory:
+        current, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        memory = {'memory_growth_bytes': current - memory_start, 'memory_peak_bytes': peak - memory_start}
+
+    latencies.sort()
+    result = {
+        'packet_ins': len(latencies),
+        'packet_ins_per_second': len(latencies) / elapsed if elapsed > 0 else 0,
+        'latency_p50_us': _percentile(latencies, 50) * 1e6,
+        'latency_p99_us': _percentile(latencies, 99) * 1e6,
+        'latency_max_us': latencies[-1] * 1e6 if latencies else 0,
+        'connections': controller.connections.active(),
+        'flow_mods_bytes': sum(datapath.bytes for datapath in topology.datapaths.values()),
+    }
+    result.update(memory)
+    release_controller(controller)
+    return result
+
+def _percentile(values, percentile):
+    if not values:
+        return 0
+    rank = int(math.ceil(percentile / 100.0 * len(values))) - 1
+    return values[min(max(rank, 0), len(values) - 1)]
+
+def main_benchmark():
+    parser = argparse.ArgumentParser(description='Offline benchmark of the packet in handling of the controller')
+    parser.add_argument('--topology', nargs='*', help='topology folders in config/ (default: all of them)')
+    parser.add_argument('--protocol', nargs='*', default=PROTOCOLS, choices=PROTOCOLS)
+    parser.add_argument('--packets', type=int, default=2000, help='new connections and ARP requests fed to the controller')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--output', default=get_file_path(__file__, '../benchmark_results.json'))
+    args = parser.parse_args()
+
+    folders = args.topology
+    if not folders:
+        folders = sorted(os.path.basename(os.path.dirname(path)) for path in glob.glob(get_file_path(__file__, '../config/*/switches.json')))
+
+    settings = {key: costants[key] for key in ('path_install_mode', 'rule_granularity', 'path_selection', 'max_equal_cost_paths')}
+    results = list()
+    for folder in folders:
+        topology_items = None
+        for protocol in args.protocol:
+            topology = Topology(folder)
+            if topology_items is None:
+                topology_items = workload(topology, args.packets, args.seed)
+            result = {'topology': folder, 'cost_protocol': protocol}
+            result.update(run(topology, protocol, topology_items))
+            #separate run for the memory: tracing the allocations slows down the handlers
+            memory = run(Topology(folder), protocol, topology_items, measure_memory=True)
+            result.update({key: memory[key] for key in ('memory_growth_bytes', 'memory_peak_bytes')})
+            results.append(result)
+            print("{:<20} {:<18} {:>10.0f} packet in/s  p50 {:>8.1f} us  p99 {:>8.1f} us  memory {:>10} bytes".format(
+                folder, protocol, result['packet_ins_per_second'], result['latency_p50_us'], result['latency_p99_us'], result['memory_growth_bytes']))
+
+    with open(args.output, 'w') as file:
+        json.dump({'timestamp': time.time(), 'python': platform.python_version(), 'settings': settings, 'results': results}, file, indent=4)
+    print("Results written to {}".format(args.output))
+
+if __name__ == '__main__':
+    main_benchmark()
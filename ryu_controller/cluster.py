@@ -0,0 +1,196 @@
+import argparse
+import json
+import os
+import signal
+import sqlite3
+import subprocess
+import sys
+import time
+from eventlet import tpool
+from ryu.lib import hub
+from utils import get_file_path, costants
+
+'''
+    Clustered mode: several controller processes, every process owns a shard of the switches.
+
+    Every switch is connected to all the controllers of the cluster. A switch is owned by the controller
+    dpid % cluster_size: the other controllers disable the packet in messages of the switch, so every packet in is
+    handled by a single process. All the controllers can still modify the flow tables of every switch, so the
+    controller that sees the first packet of a connection installs its whole path, also on the switches of the other
+    shards.
+
+    The state that a controller cannot discover by itself is shared through a SQLite database on the local disk:
+    - links: a link is discovered (LLDP) only by the owner of its destination switch
+    - hosts: a host is discovered only by the owner of the switch where it is connected
+    - connections: the path of every connection, so the packets of a connection that reach a switch of another shard
+      follow the same path. The first controller that stores a connection wins, a controller that finds the
+      connection already stored uses the stored path, so every connection is set up only once
+    - link load: number of connections of every controller on every link, used by the path selection
+
+    The database is never accessed from the event loop of Ryu: every access runs in a thread of the eventlet pool
+    (call()), one at a time, while the greenthread that needs the result waits. The writes that nobody waits for are
+    queued and written in a single transaction by flush_writes().
+
+    The member id of a controller is its OpenFlow port minus controller_port, see main() to start a cluster.
+    Usage: python3 ryu_controller/cluster.py [--size 3]
+'''
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS links (src INTEGER, dst INTEGER, port INTEGER, owner INTEGER, PRIMARY KEY (src, dst, owner));
+CREATE TABLE IF NOT EXISTS hosts (mac TEXT PRIMARY KEY, dpid INTEGER, port INTEGER, ipv4 TEXT, owner INTEGER);
+CREATE TABLE IF NOT EXISTS connections (key TEXT PRIMARY KEY, proto INTEGER, src_ip TEXT, dst_ip TEXT, src_port INTEGER,
+                                        dst_port INTEGER, path TEXT, hops TEXT, owner INTEGER);
+CREATE TABLE IF NOT EXISTS link_load (src INTEGER, dst INTEGER, owner INTEGER, connections INTEGER, PRIMARY KEY (src, dst, owner));
+'''
+
+def store_path():
+    return get_file_path(__file__, "../{}".format(costants['cluster_store']))
+
+class ClusterStore:
+    def __init__(self, path, member, size):
+        if not 0 <= member < size:
+            raise Exception('member {} out of the cluster of size {}: the OpenFlow port must be between controller_port and controller_port + cluster_size - 1'.format(member, size))
+        self.member = member
+        self.size = size
+        #the connection is used by the threads of the pool, one at a time (see call())
+        self.db = sqlite3.connect(path, timeout=5, isolation_level=None, check_same_thread=False)
+        self.lock = hub.Semaphore(1)
+        self.writes = list()        #(statement, parameters) waiting for the next flush_writes()
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.execute('PRAGMA synchronous=OFF')
+        self.db.executescript(SCHEMA)
+        #the rows left by a previous run of this member are stale
+        for table in ('links', 'hosts', 'connections', 'link_load'):
+            self.db.execute('DELETE FROM {} WHERE owner = ?'.format(table), (self.member,))
+
+    def owner(self, dpid):
+        return dpid % self.size
+
+    def owns(self, dpid):
+        return self.owner(dpid) == self.member
+
+    #Run a function of the store in a thread of the pool: the calling greenthread waits, the event loop does not
+    def call(self, function, *args):
+        with self.lock:
+            return tpool.execute(function, *args)
+
+    def _queue(self, statement, parameters):
+        self.writes.append((statement, parameters))
+
+    #Write the queued statements in a single transaction. The queue is taken with the lock held, so the batches are
+    #written in the order of the statements
+    def flush_writes(self):
+        with self.lock:
+            writes = self.writes
+            self.writes = list()
+            if writes:
+                tpool.execute(self._write, writes)
+
+    def _write(self, writes):
+        self.db.execute('BEGIN')
+        try:
+            for statement, parameters in writes:
+                self.db.execute(statement, parameters)
+            self.db.execute('COMMIT')
+        except Exception:
+            self.db.execute('ROLLBACK')
+            raise
+
+    #Links discovered by this controller, every controller writes only its own rows
+    def put_link(self, src, dst, port):
+        self._queue('INSERT OR REPLACE INTO links VALUES (?, ?, ?, ?)', (src, dst, port, self.member))
+
+    def delete_link(self, src, dst):
+        self._queue('DELETE FROM links WHERE src = ? AND dst = ? AND owner = ?', (src, dst, self.member))
+
+    #Hosts connected to the switches of this controller
+    def put_host(self, mac, dpid, port, ipv4):
+        self._queue('INSERT OR REPLACE INTO hosts VALUES (?, ?, ?, ?, ?)', (mac, dpid, port, json.dumps(sorted(ipv4)), self.member))
+
+    def delete_host(self, mac):
+        self._queue('DELETE FROM hosts WHERE mac = ? AND owner = ?', (mac, self.member))
+
+    #Number of connections of this controller on a link
+    def put_link_load(self, src, dst, connections):
+        if connections > 0:
+            self._queue('INSERT OR REPLACE INTO link_load VALUES (?, ?, ?, ?)', (src, dst, self.member, connections))
+        else:
+            self._queue('DELETE FROM link_load WHERE src = ? AND dst = ? AND owner = ?', (src, dst, self.member))
+
+    def update_connection(self, key, path, hops):
+        self._queue('UPDATE connections SET path = ?, hops = ? WHERE key = ?', (json.dumps(path), self._hops(hops), str(key)))
+
+    def delete_connection(self, key):
+        self._queue('DELETE FROM connections WHERE key = ? AND owner = ?', (str(key), self.member))
+
+    #State of the other controllers, read with call(): (links, hosts, link load)
+    #links: list of (src dpid, dst dpid, port number on src)
+    #hosts: list of (mac, dpid, port number, ipv4 addresses)
+    #link load: (src dpid, dst dpid) -> number of connections
+    def remote_state(self):
+        links = self.db.execute('SELECT src, dst, port FROM links WHERE owner != ?', (self.member,)).fetchall()
+        rows = self.db.execute('SELECT mac, dpid, port, ipv4 FROM hosts WHERE owner != ?', (self.member,)).fetchall()
+        hosts = [(mac, dpid, port, json.loads(ipv4)) for mac, dpid, port, ipv4 in rows]
+        load = dict(((src, dst), count) for src, dst, count in
+                    self.db.execute('SELECT src, dst, SUM(connections) FROM link_load WHERE owner != ? GROUP BY src, dst', (self.member,)))
+        return (links, hosts, load)
+
+    #Store the path of a new connection, unless another controller has already stored one. Read with call().
+    #Returns (fields, path, hops, owner) of the stored connection
+    def claim_connection(self, key, fields, path, hops):
+        self.db.execute('INSERT OR IGNORE INTO connections VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                        (str(key),) + tuple(fields) + (json.dumps(path), self._hops(hops), self.member))
+        return self.get_connection(key)
+
+    #Returns (fields, path, hops, owner) of a stored connection, None if the connection is not stored. Read with call()
+    def get_connection(self, key):
+        row = self.db.execute('SELECT proto, src_ip, dst_ip, src_port, dst_port, path, hops, owner FROM connections WHERE key = ?', (str(key),)).fetchone()
+        if row is None:
+            return None
+        hops = dict((dpid, (forward, reverse)) for dpid, forward, reverse in json.loads(row[6]))
+        return (tuple(row[:5]), json.loads(row[5]), hops, row[7])
+
+    #the dpids are json object keys only as strings, the hops are stored as a list
+    def _hops(self, hops):
+        return json.dumps([(dpid, forward, reverse) for dpid, (forward, reverse) in hops.items()])
+
+#Start cluster_size controller processes on the OpenFlow ports controller_port, controller_port + 1, ... and the
+#REST API ports controller_api_port, controller_api_port + 1, ... and stop them all on Ctrl-C
+def main():
+    parser = argparse.ArgumentParser(description='Start the controllers of a cluster on this machine')
+    parser.add_argument('--size', type=int, default=costants['cluster_size'], help='number of controllers, it must match cluster_size')
+    args = parser.parse_args()
+    if args.size != costants['cluster_size']:
+        print("Set \"cluster_size\": {} in config/constants.json, the controllers read the size of the cluster from it".format(args.size))
+        exit(1)
+
+    #the state of a previous cluster is stale
+    for suffix in ('', '-wal', '-shm'):
+        if os.path.exists(store_path() + suffix):
+            os.remove(store_path() + suffix)
+
+    folder = os.path.dirname(os.path.realpath(__file__))
+    processes = list()
+    for member in range(args.size):
+        command = ['ryu-manager', '--observe-links',
+                   '--ofp-tcp-listen-port', str(costants['controller_port'] + member),
+                   '--wsapi-port', str(costants['controller_api_port'] + member),
+                   os.path.join(folder, 'main.py'), os.path.join(folder, 'stats_monitor.py')]
+        print("{}  {}CLUSTER {}Starting controller {}: {}".format(costants['net_emote'], costants['ansi_green'], costants['ansi_white'], member, ' '.join(command)))
+        processes.append(subprocess.Popen(command))
+
+    try:
+        while all(process.poll() is None for process in processes):
+            time.sleep(1)
+        print("{}  {}CLUSTER {}A controller has stopped, stopping the cluster".format(costants['error_emote'], costants['ansi_red'], costants['ansi_white']))
+    except KeyboardInterrupt:
+        pass
+    for process in processes:
+        if process.poll() is None:
+            process.send_signal(signal.SIGINT)
+    for process in processes:
+        process.wait()
+    sys.exit(0)
+
+if __name__ == "__main__":
+    main()
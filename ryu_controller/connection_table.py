@@ -0,0 +1,143 @@
+'''
+    Connection table used by the controller to remember the path chosen for every TCP/UDP connection.
+
+    Connections are indexed by a canonical bidirectional 5-tuple (protocol, lower endpoint, higher endpoint), so both
+    directions of a connection map to the same entry and a lookup takes constant time.
+    Every entry stores a precomputed dpid -> (forward port, reverse port) map, so the next hop of a packet is resolved
+    without walking the path.
+    Every entry also keeps track of the rules installed on the switches: when all of them have expired the connection
+    is evicted from the table.
+    The table counts the connections assigned to every directed link, in the direction of their first packet. In
+    clustered mode the connections loaded from the other controllers are not counted, their owners publish them.
+'''
+
+#A single TCP/UDP connection and the path chosen for it
+class Connection:
+    __slots__ = ('proto', 'src_ip', 'dst_ip', 'src_port', 'dst_port', 'path', 'hops', 'installed', 'counters', 'rates', 'moved_at', 'counted')
+
+    def __init__(self, proto, src_ip, dst_ip, src_port, dst_port, path, hops, counted=True):
+        self.proto = proto
+        self.src_ip = src_ip
+        self.dst_ip = dst_ip
+        self.src_port = src_port
+        self.dst_port = dst_port
+        self.path = path
+        self.hops = hops    #dpid -> (forward port, reverse port)
+        self.installed = set()  #(dpid, reverse) of the rules currently installed on the switches
+        self.counters = [None, None]    #last (byte count, timestamp) of the ingress rule of each direction
+        self.rates = [0.0, 0.0]         #bits per second of each direction (forward, reverse)
+        self.moved_at = 0               #last time the connection has been moved to another path
+        self.counted = counted          #True if the connection counts in the load of the links of its path
+
+    #Return the output port of the switch for the given direction, None if the switch is not on the path
+    def next_hop(self, dpid, reverse=False):
+        ports = self.hops.get(dpid)
+        if ports is None:
+            return None
+        return ports[1] if reverse else ports[0]
+
+    def rule_installed(self, dpid, reverse=False):
+        self.installed.add((dpid, reverse))
+
+    #Returns True if no rule of the connection is left on the switches
+    def rule_removed(self, dpid, reverse=False):
+        self.installed.discard((dpid, reverse))
+        return len(self.installed) == 0
+
+    #Update the rate of a direction with the byte count of its ingress rule, returns the rate in bits per second
+    def update_rate(self, reverse, byte_count, timestamp):
+        direction = 1 if reverse else 0
+        previous = self.counters[direction]
+        self.counters[direction] = (byte_count, timestamp)
+        #the counter restarts when the rule is installed again
+        if previous is not None and byte_count >= previous[0] and timestamp > previous[1]:
+            self.rates[direction] = (byte_count - previous[0]) * 8 / (timestamp - previous[1])
+        return self.rates[direction]
+
+    def key(self):
+        return connection_key(self.proto, self.src_ip, self.dst_ip, self.src_port, self.dst_port)
+
+#Canonical bidirectional key: both directions of a connection share the same key
+def connection_key(proto, src_ip, dst_ip, src_port, dst_port):
+    src = (src_ip, src_port)
+    dst = (dst_ip, dst_port)
+    if src <= dst:
+        return (proto, src, dst)
+    return (proto, dst, src)
+
+class ConnectionTable:
+    def __init__(self):
+        self.table = dict()
+        self.expired = 0    #number of connections evicted because all their rules expired
+        self.links = dict() #(src dpid, dst dpid) -> number of connections whose path uses the link
+        self.remote_links = dict()  #same count for the connections of the other controllers of a cluster
+
+    def __len__(self):
+        return len(self.table)
+
+    def __iter__(self):
+        return iter(self.table.values())
+
+    #Add a new connection, the path is stored in the direction of the first packet
+    def add(self, proto, src_ip, dst_ip, src_port, dst_port, path, hops, counted=True):
+        connection = Connection(proto, src_ip, dst_ip, src_port, dst_port, path, hops, counted)
+        previous = self.table.get(connection.key())
+        if previous is not None and previous.counted:
+            self._count(previous.path, -1)
+        self.table[connection.key()] = connection
+        if counted:
+            self._count(path, 1)
+        return connection
+
+    #Move a connection to another path
+    def set_path(self, connection, path, hops):
+        if self.table.get(connection.key()) is connection and connection.counted:
+            self._count(connection.path, -1)
+            self._count(path, 1)
+        connection.path = path
+        connection.hops = hops
+
+    #Add the hops of a new branch to a connection shared by several sources, the hops already known are kept
+    def extend(self, connection, hops):
+        for dpid, ports in hops.items():
+            if dpid not in connection.hops:
+                connection.hops[dpid] = ports
+
+    #Number of connections assigned to the link from src to dst
+    def connections_on_link(self, src, dst):
+        return self.links.get((src, dst), 0) + self.remote_links.get((src, dst), 0)
+
+    def _count(self, path, delta):
+        for i in range(len(path) - 1):
+            link = (path[i], path[i + 1])
+            count = self.links.get(link, 0) + delta
+            if count > 0:
+                self.links[link] = count
+            else:
+                self.links.pop(link, None)
+
+    #Find a connection given the 5-tuple of a packet
+    #Returns (connection, reverse) where reverse is True if the packet goes in the opposite direction of the path
+    def find(self, proto, src_ip, dst_ip, src_port, dst_port):
+        connection = self.table.get(connection_key(proto, src_ip, dst_ip, src_port, dst_port))
+        if connection is None:
+            return (None, False)
+        reverse = connection.src_ip != src_ip or connection.src_port != src_port
+        return (connection, reverse)
+
+    def remove(self, connection):
+        if self.table.get(connection.key()) is not connection:
+            return False
+        del self.table[connection.key()]
+        if connection.counted:
+            self._count(connection.path, -1)
+        return True
+
+    #Evict a connection whose rules have all expired
+    def expire(self, connection):
+        if self.remove(connection):
+            self.expired += 1
+
+    #Number of connections currently in the table
+    def active(self):
+        return len(self.table)
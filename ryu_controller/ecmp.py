@@ -0,0 +1,37 @@
+'''
+    Equal cost multi path computation used by the SELECT_GROUP forwarding mode.
+
+    For every destination switch, every other switch gets an OpenFlow select group whose buckets are the equal cost
+    next hops toward the destination. The switch hashes the flows on the buckets by itself, so the controller does
+    not have to see the first packet of every connection.
+'''
+import networkx as nx
+
+#Max weight of a bucket of a select group
+MAX_BUCKET_WEIGHT = 100
+
+#Return {switch: [(next switch, output port, link cost), ...]} with the next hops of the least cost paths toward dst
+def equal_cost_next_hops(net, dst, tolerance=1e-9):
+    #distance of every switch from dst, computed on the reversed graph
+    distance = nx.single_source_dijkstra_path_length(net.reverse(copy=False), dst, weight='weight')
+
+    next_hops = dict()
+    for switch, switch_distance in distance.items():
+        if switch == dst:
+            continue
+        hops = list()
+        for neighbor, link in net[switch].items():
+            if neighbor not in distance:
+                continue
+            if abs(link['weight'] + distance[neighbor] - switch_distance) <= tolerance * max(1.0, switch_distance):
+                hops.append((neighbor, link['port'], link['weight']))
+        if len(hops) > 0:
+            next_hops[switch] = sorted(hops)
+    return next_hops
+
+#Bucket weights proportional to the inverse of the cost of the first link:
+#HOP gives the same weight to every bucket, OSPF favours the faster links and DYNAMIC_BANDWIDTH the less loaded ones
+def bucket_weights(costs):
+    inverse = [1.0 / cost if cost > 0 else 1.0 for cost in costs]
+    best = max(inverse)
+    return [max(1, int(round(MAX_BUCKET_WEIGHT * value / best))) for value in inverse]
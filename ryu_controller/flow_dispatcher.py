@@ -0,0 +1,108 @@
+'''
+    Batched and acknowledged dispatch of the messages sent to the switches.
+
+    The messages queued for a switch while an event is handled are serialized into a single buffer and written at
+    once, followed by a barrier request. Messages that depend on the rules of the batch (e.g. the packet out of the
+    first packet of a connection) are written after the barrier, so the switch processes them only when the rules are
+    installed. Callbacks that depend on several switches are executed when all of them have replied to their barrier.
+    The queued messages are written only by flush(): every handler or monitor loop that queues messages flushes them
+    when it has finished, so no thread is spawned per event.
+    The time between the write and the barrier reply is the install latency of the switch.
+'''
+import time
+
+#Install latency of a switch, in seconds
+class InstallLatency:
+    __slots__ = ('count', 'last', 'average', 'max')
+
+    def __init__(self):
+        self.count = 0
+        self.last = 0.0
+        self.average = 0.0
+        self.max = 0.0
+
+    def add(self, latency, alpha=0.2):
+        self.count += 1
+        self.last = latency
+        self.average = latency if self.count == 1 else alpha * latency + (1 - alpha) * self.average
+        self.max = max(self.max, latency)
+
+class FlowDispatcher:
+    def __init__(self):
+        self.queues = dict()        #dpid -> (datapath, messages before the barrier, messages after the barrier)
+        self.waiting = dict()       #dpid -> groups waiting for the next barrier of the switch
+        self.barriers = dict()      #(dpid, xid) -> (send time, groups)
+        self.latency = dict()       #dpid -> InstallLatency
+        self.batches = 0            #number of writes
+        self.messages = 0           #number of messages sent through the dispatcher
+
+    def _queue(self, datapath):
+        entry = self.queues.get(datapath.id)
+        if entry is None or entry[0] is not datapath:
+            entry = (datapath, list(), list())
+            self.queues[datapath.id] = entry
+        return entry
+
+    #Queue a message (e.g. a flow mod) for the next batch of the switch
+    def send(self, datapath, msg):
+        self._queue(datapath)[1].append(msg)
+
+    #Queue a message that must be processed after the messages of the batch (e.g. a packet out)
+    def send_after_barrier(self, datapath, msg):
+        self._queue(datapath)[2].append(msg)
+
+    #Execute the callback when all the switches have confirmed the messages queued so far
+    def after(self, datapaths, callback):
+        group = dict()
+        group['remaining'] = set(datapath.id for datapath in datapaths)
+        group['callback'] = callback
+        for datapath in datapaths:
+            self._queue(datapath)
+            self.waiting.setdefault(datapath.id, list()).append(group)
+
+    #Write the batch of every switch: messages, barrier request and messages after the barrier, in a single write
+    def flush(self):
+        if not self.queues:
+            return
+        queues = self.queues
+        self.queues = dict()
+        for dpid, (datapath, messages, after_barrier) in queues.items():
+            buf = bytearray()
+            for msg in messages:
+                buf += self._serialize(datapath, msg)
+
+            barrier = datapath.ofproto_parser.OFPBarrierRequest(datapath)
+            buf += self._serialize(datapath, barrier)
+            self.barriers[(dpid, barrier.xid)] = (time.time(), self.waiting.pop(dpid, list()))
+
+            for msg in after_barrier:
+                buf += self._serialize(datapath, msg)
+
+            datapath.send(bytes(buf))
+            self.batches += 1
+            self.messages += len(messages) + len(after_barrier)
+
+    def _serialize(self, datapath, msg):
+        datapath.set_xid(msg)
+        msg.serialize()
+        return msg.buf
+
+    #Barrier reply received: update the install latency and run the callbacks whose switches have all replied
+    def barrier_reply(self, dpid, xid):
+        entry = self.barriers.pop((dpid, xid), None)
+        if entry is None:
+            return False
+        sent, groups = entry
+        self.latency.setdefault(dpid, InstallLatency()).add(time.time() - sent)
+        for group in groups:
+            group['remaining'].discard(dpid)
+            if len(group['remaining']) == 0:
+                group['callback']()
+        return True
+
+    #The switch has disconnected: its pending messages and barriers are dropped
+    def forget(self, dpid):
+        self.queues.pop(dpid, None)
+        self.waiting.pop(dpid, None)
+        for key in [key for key in self.barriers.keys() if key[0] == dpid]:
+            del self.barriers[key]
@@ -0,0 +1,56 @@
+'''
+    Host table used by the controller to find where the hosts are connected and to answer ARP requests.
+
+    The table is kept up to date from the host discovery events of Ryu, so the lookups are constant time and do not
+    copy the host list of the switches app on every packet in.
+'''
+
+class HostTable:
+    def __init__(self):
+        self.locations = dict()     #mac -> (dpid, port number) of the switch port where the host is connected
+        self.macs = dict()          #ipv4 -> mac
+        self.version = 0            #incremented every time a host is added, moved or removed
+
+    def __len__(self):
+        return len(self.locations)
+
+    #Add (or move) a host discovered by Ryu
+    def add(self, host):
+        self.place(host.mac, host.port.dpid, host.port.port_no, host.ipv4)
+
+    def remove(self, host):
+        self.discard(host.mac, host.ipv4)
+
+    #Add (or move) a host given its addresses, used also for the hosts discovered by the other controllers of a cluster
+    def place(self, mac, dpid, port_no, ipv4):
+        self.locations[mac] = (dpid, port_no)
+        self.version += 1
+        for ip in ipv4:
+            self.macs[ip] = mac
+
+    def discard(self, mac, ipv4):
+        self.locations.pop(mac, None)
+        self.version += 1
+        for ip in ipv4:
+            if self.macs.get(ip) == mac:
+                del self.macs[ip]
+
+    #ipv4 addresses of every host: mac -> list of ipv4
+    def addresses(self):
+        addresses = dict()
+        for ip, mac in list(self.macs.items()):
+            addresses.setdefault(mac, []).append(ip)
+        return addresses
+
+    #Ryu does not notify the addresses learned after the host has been discovered, the controller learns them from the packets
+    def learn_ip(self, ip, mac):
+        if ip != '0.0.0.0':
+            self.macs[ip] = mac
+
+    #Return (dpid, port number) where the host is connected, (None, None) if the host is unknown
+    def location(self, mac):
+        return self.locations.get(mac, (None, None))
+
+    #Return the mac address of the host with the given ipv4 address, None if unknown
+    def mac(self, ip):
+        return self.macs.get(ip)
@@ -0,0 +1,80 @@
+'''
+    Port statistics samples of the links between switches.
+
+    Every directed link (src dpid, dst dpid) keeps the last samples of the port of the source switch in a fixed-size
+    ring buffer backed by preallocated arrays, so storing a new sample does not allocate memory.
+    The transmitted bytes of the port measure the load of the link from src to dst, the received bytes the load of the
+    opposite direction. The utilization of each direction can be estimated with:
+    - LAST: rate of the last polling interval
+    - EWMA: exponentially weighted moving average of the interval rates
+    - PERCENTILE: percentile of the interval rates in the window
+'''
+import math
+from array import array
+
+class LinkStats:
+    __slots__ = ('size', 'count', 'head', 'timestamps', 'rx_bytes', 'tx_bytes', 'alpha', 'ewma_rx', 'ewma_tx')
+
+    def __init__(self, size, alpha=0.3):
+        self.size = max(2, size)
+        self.count = 0      #number of valid samples
+        self.head = 0       #position of the next sample
+        self.timestamps = array('d', [0.0]) * self.size
+        self.rx_bytes = array('Q', [0]) * self.size
+        self.tx_bytes = array('Q', [0]) * self.size
+        self.alpha = alpha
+        self.ewma_rx = 0.0
+        self.ewma_tx = 0.0
+
+    def __len__(self):
+        return self.count
+
+    def add(self, timestamp, rx_bytes, tx_bytes):
+        self.timestamps[self.head] = timestamp
+        self.rx_bytes[self.head] = rx_bytes
+        self.tx_bytes[self.head] = tx_bytes
+        self.head = (self.head + 1) % self.size
+        if self.count < self.size:
+            self.count += 1
+
+        if self.count == 2:
+            self.ewma_rx = self._rate(self.rx_bytes, 0)
+            self.ewma_tx = self._rate(self.tx_bytes, 0)
+        elif self.count > 2:
+            self.ewma_rx = self.alpha * self._rate(self.rx_bytes, 0) + (1 - self.alpha) * self.ewma_rx
+            self.ewma_tx = self.alpha * self._rate(self.tx_bytes, 0) + (1 - self.alpha) * self.ewma_tx
+
+    #Position of the i-th most recent sample (0 is the last one)
+    def _index(self, i):
+        return (self.head - 1 - i) % self.size
+
+    #Rate in bits per second of the i-th most recent interval (0 is the last one)
+    def _rate(self, counters, i):
+        last = self._index(i)
+        prev = self._index(i + 1)
+        duration = self.timestamps[last] - self.timestamps[prev]
+        if duration <= 0:
+            duration = 1
+        #the counters restart from 0 when the switch reconnects
+        return max(counters[last] - counters[prev], 0) * 8 / duration
+
+    def _counters(self, direction):
+        return self.tx_bytes if direction == 'tx' else self.rx_bytes
+
+    #Rates of all the intervals in the window, oldest first
+    def rates(self, direction='tx'):
+        counters = self._counters(direction)
+        return [self._rate(counters, i) for i in range(self.count - 2, -1, -1)]
+
+    #Estimated utilization in bits per second of a direction ('tx' or 'rx'), 0 if there are not enough samples
+    def utilization(self, estimator='LAST', direction='tx', percentile=90):
+        if self.count < 2:
+            return 0
+        if estimator == 'EWMA':
+            return self.ewma_tx if direction == 'tx' else self.ewma_rx
+        if estimator == 'PERCENTILE':
+            rates = sorted(self.rates(direction))
+            rank = int(math.ceil(percentile / 100.0 * len(rates))) - 1
+            return rates[min(max(rank, 0), len(rates) - 1)]
+        return self._rate(self._counters(direction), 0)
+
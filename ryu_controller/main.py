@@ -1,12 +1,28 @@
 from ryu.base import app_manager
 from ryu.controller import ofp_event
-from ryu.controller.handler import CONFIG_DISPATCHER, MAIN_DISPATCHER
+from ryu.controller.handler import CONFIG_DISPATCHER, MAIN_DISPATCHER, DEAD_DISPATCHER
 from ryu.controller.handler import set_ev_cls
-from ryu.ofproto import ofproto_v1_3
-from ryu.topology.api import get_all_host, get_all_link, get_all_switch
-from ryu.lib.packet import packet, ethernet, ether_types, ipv4, tcp, udp, arp
-from utils import print_debug,print_error,print_path,get_file_path,costants
+from ryu.ofproto import ofproto_v1_3, ofproto_common
+from ryu.topology import event
+from ryu.lib import hub
+from ryu.topology.api import get_switch
+from ryu import cfg
+from ryu.app.wsgi import WSGIApplication
+from ryu.lib.packet import packet, ethernet, ether_types, arp
+from utils import print_debug,print_error,get_file_path,setup_file_log,hot_log,log_sink,PathText,costants
+from connection_table import ConnectionTable, connection_key
+from host_table import HostTable
+from path_cache import PathCache
+from link_stats import LinkStats
+from flow_dispatcher import FlowDispatcher
+from packet_parser import PacketHeaders
+from rest_api import ControllerRestApi
+from metrics import registry, gauge, counter, HANDLER_LATENCY, PATH_SELECTION_LATENCY, STATS_LATENCY, FLOW_MODS
+from ecmp import equal_cost_next_hops, bucket_weights
+from cluster import ClusterStore, store_path
 import networkx as nx
+import itertools
+import zlib
 import random
 import logging
 import time
@@ -37,6 +53,10 @@ import traceback
     -> This is the rule for New UDP connections, the controller will push a new rule to the switch to route the packets using
        the shortest path according to the cost function
 
+    Match: dst MAC -> priority 200 (only in SELECT_GROUP forwarding mode)
+    Actions: Forward to port if the host is connected to the switch, otherwise to the select group of the destination switch
+    -> The switch itself spreads the connections on the equal cost next hops, TCP/UDP packets do not reach the controller
+
     Match: TCP/UDP Connection -> prority 1000
     Actions: Forward to port using the shortest path
     -> This is the rule for the next packets of a connection, the controller had push a new rule to the switch to route the packets using
@@ -45,30 +65,73 @@ import traceback
 
     This is the basic flow entry table for the switches, the controller will push new rules to the switches to route the packets
 '''
+#Cookie of the priority 1000 rules of the TCP/UDP connections
+CONNECTION_COOKIE = 0x1000
+CONNECTION_COOKIE_MASK = 0xffffffffffffffff
+
 class RyuController(app_manager.RyuApp):
     OFP_VERSIONS = [ofproto_v1_3.OFP_VERSION]
+    _CONTEXTS = {'wsgi': WSGIApplication}
 
     def __init__(self, *args, **kwargs):
         super(RyuController, self).__init__(*args, **kwargs)
-        self.connections = list()
-        self.net = None
-        self.switch_stats = dict() #switch ports statistics
-        self.nominal_bandwidth = dict() #nominal bandwidth obtained from the switch
+        self.connections = ConnectionTable() #TCP/UDP connections and their paths
+        self.host_table = HostTable() #hosts location and addresses, kept up to date by the host events
+        self.path_cache = PathCache() #equal cost paths between switches, dropped when the graph changes
+        self.net = nx.DiGraph() #switch graph, kept up to date by the topology events
+        self.switch_stats = dict() #(src dpid, dst dpid) -> statistics of the port of the link on the source switch
+        self.port_peers = dict() #(dpid, port number) -> dpid of the switch connected to the port
+        self.nominal_bandwidth = dict() #(dpid, port number) -> nominal bandwidth obtained from the switch
+        self.link_bandwidth = dict() #(src dpid, dst dpid) -> nominal bandwidth of the link used by the cost functions
+        self.dispatcher = FlowDispatcher() #batched flow mods, barriers and install latency of the switches
+        self.headers = PacketHeaders() #headers of the packet in being handled, reused for every packet in
+        self.installed_rules = dict() #dpid -> number of connection rules installed on the switch
+        self.last_weight_refresh = dict() #dpid -> time of the last DYNAMIC_BANDWIDTH weight refresh of its links
+        self.ecmp_groups = dict() #(dpid, destination dpid) -> buckets of the select group installed on the switch
+        self.ecmp_host_rules = dict() #(dpid, host mac) -> ('port'|'group', value) of the rule installed on the switch
+        self.ecmp_programmed = None #(topology epoch, weight epoch, host version) of the last ECMP programming
+        self.cluster = None #shared state of the cluster, None if the controller is not part of a cluster
+        self.cluster_published = dict() #mac -> (dpid, port number, ipv4) of the hosts published to the cluster
+        self.cluster_imported = dict() #mac -> (dpid, port number, ipv4) of the hosts discovered by the other controllers
+        self.cluster_published_load = dict() #(src dpid, dst dpid) -> connections of this controller published to the cluster
+        self.cluster_waiting = dict() #connection key -> (packet in message, in port) waiting for the cluster store
+        self.cluster_chosen = dict() #connection key -> path stored by this controller, not yet in the connection table
+        self.cluster_owned = set() #keys of the connections stored by this controller
+        if costants['cluster_size'] > 1:
+            #the member id is the offset of the OpenFlow port of this controller from controller_port,
+            #ryu listens on the default OpenFlow port when the option is not set
+            listen_port = cfg.CONF.ofp_tcp_listen_port
+            if listen_port is None:
+                listen_port = ofproto_common.OFP_TCP_PORT
+            member = listen_port - costants['controller_port']
+            self.cluster = ClusterStore(store_path(),member,costants['cluster_size'])
+            self.cluster_thread = hub.spawn(self._cluster_sync)
+        #with DESTINATION granularity every switch chooses its next hop with a hash, the controllers agree without sharing the paths
+        self.share_connections = self.cluster is not None and costants['rule_granularity'] != 'DESTINATION'
+        if costants['forwarding_mode'] == 'SELECT_GROUP':
+            self.ecmp_thread = hub.spawn(self._ecmp_monitor)
+        elif costants['elephant_rerouting']:
+            self.elephant_thread = hub.spawn(self._elephant_monitor)
 
         self.timestart = time.time()
         #Logging
         log_file_name = get_file_path(__file__, "../ryu_controller.log")
-        root_logger = logging.getLogger()
-        root_logger.handlers = []
         debug_level = logging.DEBUG if costants['debug'] == True else logging.INFO
-        logging.basicConfig(level=debug_level,filename=log_file_name,filemode='a',format='%(asctime)s - %(levelname)s - %(message)s')
+        #the records are written to the file by the log sink thread, the handlers never block on the file
+        self.log_handler = setup_file_log(log_file_name,debug_level)
         self.logger = logging.getLogger("RyuController")
-        self.logger.setLevel(logging.DEBUG)
-        #File handler
-        fh = logging.FileHandler(log_file_name)
-        fh.setLevel(logging.DEBUG)
-        fh.setFormatter(logging.Formatter('%(asctime)s - %(levelname)s - %(message)s'))
-        self.logger.addHandler(fh)
+        self.logger.setLevel(debug_level)
+
+        #in debug mode the nominal bandwidth of the links is taken from the topology file
+        if costants['debug']:
+            self._load_nominal_bandwidth_from_file()
+
+        if self.cluster is not None:
+            self.logger.info("Cluster member %s of %s, store: %s",self.cluster.member,self.cluster.size,store_path())
+
+        #REST API: /metrics, /hosts
+        registry.add_collector(self.metrics_gauges)
+        kwargs['wsgi'].register(ControllerRestApi,{'controller': self})
         
     #Event handler executed when a switch connects to the controller
     @set_ev_cls(ofp_event.EventOFPSwitchFeatures, CONFIG_DISPATCHER)
@@ -143,10 +206,32 @@ class RyuController(app_manager.RyuApp):
 
         #sending the flow mod message to the switch
         datapath.send_msg(mod)
+        FLOW_MODS.inc(1,1)
+        FLOW_MODS.inc(2,100)
+
+        #clustered mode: the packet in messages of a switch are handled only by the controller that owns it
+        if self.cluster is not None and not self.cluster.owns(datapath.id):
+            self._disable_packet_in(datapath)
+
+    #Stop the packet in messages of a switch toward this controller, port status and flow removed messages are kept
+    def _disable_packet_in(self,datapath):
+        ofproto = datapath.ofproto
+        parser = datapath.ofproto_parser
+        port_status = 1 << ofproto.OFPPR_ADD | 1 << ofproto.OFPPR_DELETE | 1 << ofproto.OFPPR_MODIFY
+        flow_removed = (1 << ofproto.OFPRR_IDLE_TIMEOUT | 1 << ofproto.OFPRR_HARD_TIMEOUT |
+                        1 << ofproto.OFPRR_DELETE | 1 << ofproto.OFPRR_GROUP_DELETE)
+        #every mask is [master or equal role, slave role]
+        datapath.send_msg(parser.OFPSetAsync(datapath,[0,0],[port_status,port_status],[flow_removed,0]))
 
     #Event handler executed when a packet in message is received from a switch
     @set_ev_cls(ofp_event.EventOFPPacketIn, MAIN_DISPATCHER)
+    @HANDLER_LATENCY.time('packet_in')
     def packet_in_handler(self, ev):
+        self._packet_in(ev)
+        #all the messages produced by the packet in are written at once
+        self.dispatcher.flush()
+
+    def _packet_in(self, ev):
         #Getting the packet in message
         msg = ev.msg
         #Getting the datapath instance from the switch
@@ -158,56 +243,39 @@ class RyuController(app_manager.RyuApp):
         #Getting the in port from the packet in message
         in_port = msg.match['in_port']
 
-        pkt = packet.Packet(msg.data) 
-        eth = pkt.get_protocol(ethernet.ethernet)
+        #only the needed header fields are read, see packet_parser.py
+        headers = self.headers
 
         #Check if the packet is an ethernet packet
-        if eth is None:
+        if not headers.parse(msg.data):
             print_error("No ethernet packet found")
             return
         
         #check if the packet is an arp packet
-        if eth.ethertype == ether_types.ETH_TYPE_ARP:
-            self.proxy_arp_handler(msg,datapath,parser,ofproto,in_port,eth)
+        if headers.ethertype == ether_types.ETH_TYPE_ARP:
+            self.proxy_arp_handler(msg,datapath,parser,ofproto,in_port,headers)
             return
         
         #check if the packet is an LLDP packet
-        if eth.ethertype != ether_types.ETH_TYPE_IP:
+        if headers.ethertype != ether_types.ETH_TYPE_IP:
             return 
         
         #check if the packet is a TCP or UDP packet
-        if eth.ethertype == ether_types.ETH_TYPE_IP:
-            ip = pkt.get_protocol(ipv4.ipv4)
-            if ip.proto == 6 or ip.proto == 17:
-                self._packet_in_TCP_or_UDP_handler(msg,datapath,parser,ofproto,in_port,eth,ip)
+        if headers.ethertype == ether_types.ETH_TYPE_IP:
+            self.host_table.learn_ip(headers.ipv4_src,headers.eth_src)
+            #IP fragments without the TCP/UDP header are forwarded as normal traffic
+            if (headers.ip_proto == 6 or headers.ip_proto == 17) and headers.src_port is not None:
+                self._packet_in_TCP_or_UDP_handler(msg,datapath,parser,ofproto,in_port,headers)
             else:
-                self._packet_in_not_TCP_or_UDP_handler(msg,datapath,parser,ofproto,in_port,eth)
+                self._packet_in_not_TCP_or_UDP_handler(msg,datapath,parser,ofproto,in_port,headers)
 
     #Event handler executed when a packet in message is received from a switch and the packet is a TCP or UDP packet
-    def _packet_in_TCP_or_UDP_handler(self,msg,datapath,parser,ofproto,in_port,eth,ip):
-        print("\n{} packet received from switch with datapath id: {}".format("TCP" if ip.proto == 6 else "UDP",datapath.id))
-
-        if self.net is None:
-            print_debug("Creating network graph...")
-            self.net = self.create_net_graph()
-            print_debug("Network graph created")
+    @HANDLER_LATENCY.time('tcp_udp')
+    def _packet_in_TCP_or_UDP_handler(self,msg,datapath,parser,ofproto,in_port,headers):
+        hot_log.debug("{} packet received from switch with datapath id: {}","TCP" if headers.ip_proto == 6 else "UDP",datapath.id)
 
         #Getting the destination MAC address
-        dst = eth.dst
-
-        #getting tcp/udp port
-        pkt = packet.Packet(msg.data)
-        
-        if ip.proto == 6:
-            tcp_pkt = pkt.get_protocol(tcp.tcp)
-            src_port = tcp_pkt.src_port
-            dst_port = tcp_pkt.dst_port
-            connection_type = 'TCP'
-        elif ip.proto == 17:
-            udp_pkt = pkt.get_protocol(udp.udp)
-            src_port = udp_pkt.src_port
-            dst_port = udp_pkt.dst_port
-            connection_type = 'UDP'
+        dst = headers.eth_dst
 
         #Finding the switch and port where the destination host is connected to
         dst_switch, out_port = self._find_destination_switch(dst)
@@ -216,166 +284,490 @@ class RyuController(app_manager.RyuApp):
         if dst_switch is None or out_port is None:
             print_error("Destination switch not found, ignoring packet")
             return
-        
+
+        #the fields matched by the rule depend on the rule granularity
+        fields = self._rule_fields(headers.ip_proto,headers.ipv4_src,headers.ipv4_dst,headers.src_port,headers.dst_port)
+        match = self._connection_match(parser,*fields)
+        connection, reverse = self.connections.find(*fields)
+        #clustered mode: the connection may have been set up by another controller, the store is read in another
+        #greenthread and the packet is handled again when the path of the connection is known
+        if connection is None and self.share_connections and connection_key(*fields) not in self.cluster_chosen:
+            self._wait_cluster_connection(msg,in_port,fields,dst_switch,out_port)
+            return
+        #with DESTINATION granularity the rules toward a host are shared by all the sources:
+        #a packet from a switch that is not on the known paths starts a new branch
+        new_branch = connection is None or datapath.id not in connection.hops
+
+        #FULL_PATH mode -> push the rules for every hop of the new connection in both directions at once
+        if costants['path_install_mode'] == 'FULL_PATH' and new_branch:
+            if self._install_full_path(msg,datapath,parser,in_port,fields,connection,dst_switch,out_port):
+                return
+
         #I have to calculate the output port
         if datapath.id == dst_switch:   #if the destination is connected to the switch
+            if new_branch:
+                connection = self._add_path(fields,connection,[datapath.id],in_port,out_port)
             output_port = out_port  #I just need to send the packet to the host
-            #Creating the packet out message
-            if connection_type == 'TCP':
-                match = parser.OFPMatch(
-                    eth_type = ether_types.ETH_TYPE_IP,
-                    ip_proto = ip.proto,
-                    ipv4_src = ip.src,
-                    ipv4_dst = ip.dst,
-                    tcp_src = src_port,
-                    tcp_dst = dst_port
-                )
-            else:
-                match = parser.OFPMatch(
-                    eth_type = ether_types.ETH_TYPE_IP,
-                    ip_proto = ip.proto,
-                    ipv4_src = ip.src,
-                    ipv4_dst = ip.dst,
-                    udp_src = src_port,
-                    udp_dst = dst_port
-                )
             actions = [parser.OFPActionOutput(output_port)] #output port
-            print("Link from switch {} to final host using port: {}".format(datapath.id,output_port))
+            hot_log.debug("Link from switch {} to final host using port: {}",datapath.id,output_port)
             #send the packet to the host
-            self.send_odf_flow_mod(datapath,parser,match,actions,1000)
+            self.send_connection_flow_mod(datapath,parser,match,actions,connection,reverse)
 
             #route the packet to the host
             self.send_packet_out(datapath,parser,actions,in_port,msg)
 
-        elif self._path_already_exists(src_port,dst_port,ip.src,ip.dst):
-            print("This path has been already calculated! Fetching the path from internal memory...")
-            #I have to find the path and forward the packet
-            found,reverse,connection = self._find_connection(src_port,dst_port,ip.src,ip.dst,datapath.id,dst_switch)
-                
-            if not found:
-                print_error("Connection not found")
-                return
+        elif not new_branch:
+            hot_log.debug("{}  Known {}path: {}",costants['path_emote'],"reverse " if reverse else "",PathText(connection.path,datapath.id,dst_switch))
 
-            path = connection['path']
-            
-            if reverse:
-                print("Reverse path")
-                src_port = connection['dst_port']
-                dst_port = connection['src_port']
-                ip.src = connection['dst_ip']
-                ip.dst = connection['src_ip']
-
-                #iterate the path in reverse until I find the switch where the packet has to be forwarded
-                i = len(path)-1
-                found = False
-                while i >= 0:
-                    if path[i] == datapath.id:
-                        found = True
-                        break
-                    i -= 1
-
-                if not found:
-                    print_error("Switch not found in the path")
-                    return
-                
-                port = self.net[ path[i] ][ path[i-1] ]['port']
-                print("Link from switch {} to switch {} using port: {}".format(path[i],path[i-1],port))
-            else:
-                #iterate the path until I find the switch where the packet has to be forwarded
-                i = 0
-                found = False
-                while i < len(path):
-                    if path[i] == datapath.id:
-                        found = True
-                        break
-                    i += 1
-
-                if not found:
-                    print_error("Switch not found in the path")
-                    return
-
-                port = self.net[ path[i] ][ path[i+1] ]['port']
-                print("Link from switch {} to switch {} using port: {}".format(path[i],path[i+1],port))
+            #the next hop of every switch on the path is precomputed
+            port = connection.next_hop(datapath.id,reverse)
+            if port is None:
+                print_error("Switch not found in the path")
+                return
+            hot_log.debug("Link from switch {} using port: {}",datapath.id,port)
 
             actions = [parser.OFPActionOutput(port)] #output port
-
-            #match this specific tcp/udp connection
-            if ip.proto == 6:
-                match = parser.OFPMatch(
-                    eth_type=ether_types.ETH_TYPE_IP,
-                    ip_proto=6,
-                    tcp_src=src_port,
-                    tcp_dst=dst_port,
-                    ipv4_src=ip.src,
-                    ipv4_dst=ip.dst
-                )
-            elif ip.proto == 17:
-                match = parser.OFPMatch(
-                    eth_type=ether_types.ETH_TYPE_IP,
-                    ip_proto=17,
-                    udp_src=src_port,
-                    udp_dst=dst_port,
-                    ipv4_src=ip.src,
-                    ipv4_dst=ip.dst
-                )
             #send the packet to the next switch
-            self.send_odf_flow_mod(datapath,parser,match,actions,1000)
+            self.send_connection_flow_mod(datapath,parser,match,actions,connection,reverse)
 
             #Creating the packet out message
             self.send_packet_out(datapath,parser,actions,in_port,msg)
         else:
-            pathsList = nx.all_shortest_paths(self.net, source=datapath.id, target=dst_switch, weight='weight', method='dijkstra')
-            #iterable to list 
-            paths = list(pathsList)
-            print("{}  {}PATH FINDING {}I have found {} possible paths from {} to {}".format(costants['path_emote'],costants['ansi_green'],costants['ansi_white'],len(paths),datapath.id,dst_switch))
-            # get a random pathå
-            path = random.choice(paths)
-            print("{}  {}PATH FINDING {} I have chosen the path: ".format(costants['path_emote'],costants['ansi_green'],costants['ansi_white']),end='')
-            print_path(path,datapath.id,dst_switch)
-            #create a new connection
-            conn = dict()
-            conn['src_port'] = src_port
-            conn['dst_port'] = dst_port
-            conn['src_ip'] = ip.src
-            conn['dst_ip'] = ip.dst
-            conn['path'] = path
-
-            #add the new connection to the list
-            self.connections.append(conn)
+            path = self._new_path(datapath.id,dst_switch,fields)
+            if path is None:
+                return
+            #add the new connection to the table
+            connection = self._add_path(fields,connection,path,in_port,out_port)
 
             #push the new rul to the switch to forward the packet to the next switch
-            first_link = self.net[ path[0] ][ path[1] ]
-            actions = [parser.OFPActionOutput(first_link['port'])] #output port
-
-            #match this specific tcp/udp connection
-            if ip.proto == 6:
-                match = parser.OFPMatch(
-                    eth_type=ether_types.ETH_TYPE_IP,
-                    ip_proto=6,
-                    tcp_src=src_port,
-                    tcp_dst=dst_port,
-                    ipv4_src=ip.src,
-                    ipv4_dst=ip.dst
-                )
-            elif ip.proto == 17:
-                match = parser.OFPMatch(
-                    eth_type=ether_types.ETH_TYPE_IP,
-                    ip_proto=17,
-                    udp_src=src_port,
-                    udp_dst=dst_port,
-                    ipv4_src=ip.src,
-                    ipv4_dst=ip.dst
-                )
-            print("Link from switch {} to host using port: {}".format(path[0],first_link['port']))
+            port = connection.next_hop(datapath.id)
+            actions = [parser.OFPActionOutput(port)] #output port
+            hot_log.debug("Link from switch {} to host using port: {}",path[0],port)
             #send the packet to the next switch
-            self.send_odf_flow_mod(datapath,parser,match,actions,1000)
+            self.send_connection_flow_mod(datapath,parser,match,actions,connection)
 
             #Creating the packet out message
             self.send_packet_out(datapath,parser,actions,in_port,msg)
-            
+
+    #Fields matched by the rules of a packet according to the rule granularity, 0 and '' are wildcards:
+    #CONNECTION -> 5-tuple, HOST_PAIR -> source and destination host, DESTINATION -> destination host
+    def _rule_fields(self,proto,src_ip,dst_ip,src_port,dst_port):
+        granularity = costants['rule_granularity']
+        if granularity == 'HOST_PAIR':
+            return (0,src_ip,dst_ip,0,0)
+        if granularity == 'DESTINATION':
+            return (0,'',dst_ip,0,0)
+        return (proto,src_ip,dst_ip,src_port,dst_port)
+
+    #Path of a new connection (or of a new branch toward a destination) from the switch src to the switch dst
+    @PATH_SELECTION_LATENCY.time()
+    def _new_path(self,src,dst,fields):
+        if costants['rule_granularity'] == 'DESTINATION':
+            return self._destination_path(src,dst,fields[2])
+        #clustered mode: the path has already been chosen and stored by _resolve_cluster_connection
+        if self.share_connections:
+            path = self.cluster_chosen.pop(connection_key(*fields),None)
+            if path is not None:
+                return path
+        return self._select_path(src,dst)
+
+    #Add a new connection to the table, or a new branch to a connection with DESTINATION granularity
+    def _add_path(self,fields,connection,path,in_port,out_port):
+        hops = self._path_hops(path,in_port,out_port)
+        if connection is None:
+            return self.connections.add(fields[0],fields[1],fields[2],fields[3],fields[4],path,hops)
+        self.connections.extend(connection,hops)
+        return connection
+
+    #Clustered mode: the packets of a connection unknown to this controller wait for the cluster store, only the
+    #first one starts the lookup
+    def _wait_cluster_connection(self,msg,in_port,fields,dst_switch,out_port):
+        key = connection_key(*fields)
+        waiting = self.cluster_waiting.get(key)
+        if waiting is not None:
+            waiting.append((msg,in_port))
+            return
+        self.cluster_waiting[key] = [(msg,in_port)]
+        hub.spawn(self._resolve_cluster_connection,key,fields,msg.datapath.id,in_port,dst_switch,out_port)
+
+    #Clustered mode: load the connection stored by another controller, or store a new path for it, then handle the
+    #waiting packets again. The store is accessed in a thread of the pool, the event loop keeps running
+    def _resolve_cluster_connection(self,key,fields,dpid,in_port,dst_switch,out_port):
+        try:
+            #the queued deletes of the connections expired on this controller are written before the lookup
+            self.cluster.flush_writes()
+            stored = None
+            #a packet from a host starts a new connection, a packet from a switch follows a path set up by another controller
+            if (dpid,in_port) in self.port_peers:
+                stored = self.cluster.call(self.cluster.get_connection,key)
+            if stored is None:
+                path = [dpid] if dpid == dst_switch else self._select_path(dpid,dst_switch)
+                if path is None:
+                    return
+                stored = self.cluster.call(self.cluster.claim_connection,key,fields,path,self._path_hops(path,in_port,out_port))
+            (proto, src_ip, dst_ip, src_port, dst_port), path, hops, owner = stored
+            #the table may have changed while waiting for the store
+            if self.connections.find(*fields)[0] is None:
+                if owner == self.cluster.member:
+                    #the path stored by this controller is used by the next packet in as a new connection
+                    self.cluster_owned.add(key)
+                    self.cluster_chosen[key] = path
+                else:
+                    #the owner of the connection counts it in the load of the links
+                    self.connections.add(proto,src_ip,dst_ip,src_port,dst_port,path,hops,counted=False)
+            for msg, packet_in_port in self.cluster_waiting.pop(key,[]):
+                headers = PacketHeaders()
+                if headers.parse(msg.data):
+                    datapath = msg.datapath
+                    self._packet_in_TCP_or_UDP_handler(msg,datapath,datapath.ofproto_parser,datapath.ofproto,packet_in_port,headers)
+            self.dispatcher.flush()
+        except Exception as e:
+            print_error("Received exception {} while reading the connection from the cluster store".format(str(e)))
+            print_error("Traceback: {}".format(traceback.format_exc()))
+        finally:
+            self.cluster_waiting.pop(key,None)
+            self.cluster_chosen.pop(key,None)
+
+    #Equal cost paths from src to dst, None if there is no path
+    def _equal_cost_paths(self,src,dst):
+        paths = self.path_cache.get(src,dst)
+        if paths is None:
+            try:
+                pathsList = nx.all_shortest_paths(self.net, source=src, target=dst, weight='weight', method='dijkstra')
+                #iterable to list, the number of equal cost paths can grow exponentially with dense topologies
+                paths = list(itertools.islice(pathsList,costants['max_equal_cost_paths']))
+            except (nx.NetworkXNoPath, nx.NodeNotFound) as e:
+                print_error("No path found from {} to {}: {}".format(src,dst,e))
+                return None
+            self.path_cache.put(src,dst,paths)
+        return paths
+
+    #DESTINATION granularity: every switch chooses its next hop toward a host among its equal cost next hops using a
+    #hash of the host address, so the paths of all the sources toward the host agree on every switch they share
+    def _destination_path(self,src,dst,dst_ip):
+        path = [src]
+        while path[-1] != dst:
+            paths = self._equal_cost_paths(path[-1],dst)
+            if paths is None:
+                return None
+            next_hops = sorted(set(p[1] for p in paths))
+            path.append(next_hops[zlib.crc32("{}:{}".format(dst_ip,path[-1]).encode()) % len(next_hops)])
+        hot_log.debug("{}  {}PATH FINDING {} I have chosen the path: {}",costants['path_emote'],costants['ansi_green'],costants['ansi_white'],PathText(path,src,dst))
+        return path
+
+    #Choose one of the least cost paths from the source switch to the destination switch, None if there is no path
+    def _select_path(self,src,dst):
+        if src == dst:
+            return [src]
+        paths = self._equal_cost_paths(src,dst)
+        if paths is None:
+            return None
+        path = self._choose_path(paths)
+        hot_log.debug("{}  {}PATH FINDING {} I have chosen the path: {} (out of {} paths)",costants['path_emote'],costants['ansi_green'],costants['ansi_white'],PathText(path,src,dst),len(paths))
+        return path
+
+    #Choose one of the equal cost paths according to the path selection policy
+    def _choose_path(self,paths):
+        policy = costants['path_selection']
+        if len(paths) == 1 or policy == 'RANDOM':
+            return random.choice(paths)
+
+        if policy == 'POWER_OF_TWO':
+            #compare only two random candidates
+            candidates = random.sample(paths,2)
+            return max(candidates,key=self._path_score)
+
+        scores = [self._path_score(path) for path in paths]
+        if policy == 'WEIGHTED_RANDOM':
+            if sum(scores) <= 0:
+                return random.choice(paths)
+            return random.choices(paths,weights=scores)[0]
+
+        #LEAST_LOADED: best score, ties are broken randomly
+        best = max(scores)
+        return random.choice([path for path, score in zip(paths,scores) if score == best])
+
+    #Score of a path for a new connection: the bandwidth the connection can expect on the bottleneck link, that is
+    #the residual bandwidth of the link shared with the connections already assigned to it. Higher is better
+    def _path_score(self,path):
+        score = None
+        for i in range(len(path)-1):
+            bandwidth = self.link_bandwidth.get((path[i],path[i+1]),costants['OSPF_reference_bandwidth'])
+            residual = max(bandwidth - self.link_utilization(path[i],path[i+1]),0)
+            share = residual / float(self.connections.connections_on_link(path[i],path[i+1]) + 1)
+            score = share if score is None else min(score,share)
+        return score if score is not None else 0
+
+    #Compute the dpid -> (forward port, reverse port) map of a path
+    #forward: next switch or, on the last switch, the destination host
+    #reverse: previous switch or, on the first switch, the port where the first packet came from
+    def _path_hops(self,path,in_port,out_port):
+        hops = dict()
+        for i in range(len(path)):
+            forward_port = out_port if i == len(path)-1 else self.net[ path[i] ][ path[i+1] ]['port']
+            reverse_port = in_port if i == 0 else self.net[ path[i] ][ path[i-1] ]['port']
+            hops[path[i]] = (forward_port,reverse_port)
+        return hops
+
+    #Choose the path for a new connection and install it on every switch, in both directions.
+    #The first packet is released only when all the switches on the path have confirmed the rules with a barrier reply
+    #Returns False if the path cannot be installed at once
+    def _install_full_path(self,msg,datapath,parser,in_port,fields,connection,dst_switch,out_port):
+        path = self._new_path(datapath.id,dst_switch,fields)
+        if path is None:
+            return True     #no path to the destination, the packet is dropped
+
+        #every switch on the path must be reachable, otherwise the caller falls back to hop by hop installation
+        hops = [self._get_datapath(dpid) for dpid in path]
+        if None in hops:
+            print_error("Some switches of the path are not connected, falling back to hop by hop installation")
+            return False
+
+        #create a new connection
+        connection = self._add_path(fields,connection,path,in_port,out_port)
+        proto, src_ip, dst_ip, src_port, dst_port = fields
+        #with DESTINATION granularity the reverse traffic goes to another destination, it has its own rules
+        both_directions = costants['rule_granularity'] != 'DESTINATION'
+
+        first_actions = None
+        for hop in hops:
+            forward_port, reverse_port = connection.hops[hop.id]
+            hot_log.debug("Switch {}: forward port {}, reverse port {}",hop.id,forward_port,reverse_port)
+
+            forward_match = self._connection_match(hop.ofproto_parser,proto,src_ip,dst_ip,src_port,dst_port)
+            forward_actions = [hop.ofproto_parser.OFPActionOutput(forward_port)]
+            self.send_connection_flow_mod(hop,hop.ofproto_parser,forward_match,forward_actions,connection)
+            if both_directions:
+                reverse_match = self._connection_match(hop.ofproto_parser,proto,dst_ip,src_ip,dst_port,src_port)
+                reverse_actions = [hop.ofproto_parser.OFPActionOutput(reverse_port)]
+                self.send_connection_flow_mod(hop,hop.ofproto_parser,reverse_match,reverse_actions,connection,True)
+            if hop.id == datapath.id:
+                first_actions = forward_actions
+
+        #release the buffered packet only when every switch on the path has installed its rules
+        self.dispatcher.after(hops,lambda: self.send_packet_out(datapath,parser,first_actions,in_port,msg))
+        return True
+
+    #Event handler executed when a switch confirms that all the previous messages have been processed
+    @set_ev_cls(ofp_event.EventOFPBarrierReply, MAIN_DISPATCHER)
+    @HANDLER_LATENCY.time('barrier_reply')
+    def barrier_reply_handler(self, ev):
+        if self.dispatcher.barrier_reply(ev.msg.datapath.id,ev.msg.xid):
+            latency = self.dispatcher.latency[ev.msg.datapath.id]
+            hot_log.debug("Switch {} install latency: {:.2f} ms (average {:.2f} ms)",ev.msg.datapath.id,latency.last*1000,latency.average*1000)
+        #the callbacks may have queued new messages
+        self.dispatcher.flush()
+
+    #Event handler executed when a switch disconnects from the controller
+    @set_ev_cls(ofp_event.EventOFPStateChange, DEAD_DISPATCHER)
+    def switch_disconnected_handler(self, ev):
+        if ev.datapath.id is not None:
+            self.dispatcher.forget(ev.datapath.id)
+
+    #Event handler executed when a rule installed with the OFPFF_SEND_FLOW_REM flag is removed from a switch
+    @set_ev_cls(ofp_event.EventOFPFlowRemoved, MAIN_DISPATCHER)
+    @HANDLER_LATENCY.time('flow_removed')
+    def flow_removed_handler(self, ev):
+        msg = ev.msg
+        if msg.priority != 1000:
+            return
+
+        connection, reverse = self._connection_from_match(msg.match)
+        if connection is None:
+            return
+
+        dpid = msg.datapath.id
+        #clustered mode: the flow removed messages of the rules installed by the other controllers are received too
+        if (dpid,reverse) not in connection.installed:
+            return
+        self.installed_rules[dpid] = self.installed_rules.get(dpid,1) - 1
+
+        #evict the connection only when the rules on every hop have expired
+        if connection.rule_removed(dpid,reverse):
+            self.connections.expire(connection)
+            #only the controller that has stored the connection deletes it
+            if connection.key() in self.cluster_owned:
+                self.cluster_owned.discard(connection.key())
+                self.cluster.delete_connection(connection.key())
+            self.logger.info("Connection %s:%s -> %s:%s expired, active connections: %s, expired connections: %s, rules on switch %s: %s",
+                connection.src_ip,connection.src_port,connection.dst_ip,connection.dst_port,self.connections.active(),self.connections.expired,dpid,self.installed_rules.get(dpid,0))
+
+    #Find the connection of a priority 1000 rule given its match, returns (connection, reverse)
+    def _connection_from_match(self,match):
+        proto = match.get('ip_proto',0)
+        if proto == 6:
+            src_port, dst_port = match.get('tcp_src'), match.get('tcp_dst')
+        elif proto == 17:
+            src_port, dst_port = match.get('udp_src'), match.get('udp_dst')
+        else:
+            src_port, dst_port = 0, 0
+        return self.connections.find(proto,match.get('ipv4_src',''),match.get('ipv4_dst'),src_port,dst_port)
+
+    #Elephant flows: poll the byte counters of the connection rules on the ingress switches of the connections
+    def _elephant_monitor(self):
+        while True:
+            hub.sleep(costants['elephant_poll_interval'])
+            try:
+                self.request_connection_stats()
+            except Exception as e:
+                print_error("Received exception {} while polling the connection statistics".format(str(e)))
+                print_error("Traceback: {}".format(traceback.format_exc()))
+
+    #Request the byte counters of the connection rules to the ingress switches of the connections
+    def request_connection_stats(self):
+        ingress = set()
+        for connection in self.connections:
+            #clustered mode: a connection is measured and moved only by the controller that has stored it
+            if self.share_connections and connection.key() not in self.cluster_owned:
+                continue
+            ingress.add(connection.path[0])
+            ingress.add(connection.path[-1])
+        for dpid in ingress:
+            datapath = self._get_datapath(dpid)
+            if datapath is None:
+                continue
+            ofproto = datapath.ofproto
+            parser = datapath.ofproto_parser
+            #only the connection rules, they are marked with the connection cookie
+            req = parser.OFPFlowStatsRequest(datapath,0,ofproto.OFPTT_ALL,ofproto.OFPP_ANY,ofproto.OFPG_ANY,
+                                             CONNECTION_COOKIE,CONNECTION_COOKIE_MASK,parser.OFPMatch())
+            datapath.send_msg(req)
+
+    @set_ev_cls(ofp_event.EventOFPFlowStatsReply, MAIN_DISPATCHER)
+    @STATS_LATENCY.time('connection_stats')
+    def connection_stats_reply_handler(self, ev):
+        dpid = ev.msg.datapath.id
+        timestamp = time.time()
+        for stat in ev.msg.body:
+            if stat.priority != 1000:
+                continue
+            connection, reverse = self._connection_from_match(stat.match)
+            if connection is None:
+                continue
+            #every direction is measured on its ingress switch: the first switch of the path for the forward
+            #direction, the last one for the reverse direction
+            if dpid != (connection.path[-1] if reverse else connection.path[0]):
+                continue
+            rate = connection.update_rate(reverse,stat.byte_count,timestamp)
+            if rate >= costants['elephant_threshold']:
+                #a failed reroute (e.g. a switch of the path has left) must not stop the other connections
+                try:
+                    self.reroute_elephant(connection)
+                except Exception as e:
+                    print_error("Received exception {} while rerouting an elephant flow".format(str(e)))
+                    print_error("Traceback: {}".format(traceback.format_exc()))
+        #the rules of the moved connections are written at once
+        self.dispatcher.flush()
+
+    #Least cost paths and paths whose cost is at most elephant_cost_slack higher, from src to dst.
+    #At most elephant_candidate_paths paths are searched, and they are cached until the topology or the weights change
+    def _near_equal_cost_paths(self,src,dst):
+        paths = self.path_cache.get_near(src,dst)
+        if paths is not None:
+            return paths
+        paths = list()
+        best_cost = None
+        try:
+            for path in nx.shortest_simple_paths(self.net,src,dst,weight='weight'):
+                cost = sum(self.net[path[i]][path[i+1]]['weight'] for i in range(len(path)-1))
+                if best_cost is None:
+                    best_cost = cost
+                if cost > best_cost * (1 + costants['elephant_cost_slack']):
+                    break
+                paths.append(path)
+                if len(paths) >= costants['elephant_candidate_paths']:
+                    break
+        except (nx.NetworkXNoPath, nx.NodeNotFound):
+            pass
+        self.path_cache.put_near(src,dst,paths)
+        return paths
+
+    #Residual bandwidth of the bottleneck link of a path, own_rate is the load of a flow already on the path
+    def _path_residual(self,path,own_rate=0):
+        residual = None
+        for i in range(len(path)-1):
+            bandwidth = self.link_bandwidth.get((path[i],path[i+1]),costants['OSPF_reference_bandwidth'])
+            free = bandwidth - self.link_utilization(path[i],path[i+1]) + own_rate
+            residual = free if residual is None else min(residual,free)
+        return residual if residual is not None else 0
+
+    #Move an elephant flow to the least loaded equal or near-equal cost path, if it is better enough than the current one
+    def reroute_elephant(self,connection):
+        #with DESTINATION granularity the rules are shared by all the sources, a single flow cannot be moved
+        if costants['rule_granularity'] == 'DESTINATION':
+            return
+        src = connection.path[0]
+        dst = connection.path[-1]
+        if src == dst or time.time() - connection.moved_at < costants['elephant_reroute_cooldown']:
+            return
+
+        #the load is measured in the direction carrying most of the traffic
+        reverse = connection.rates[1] > connection.rates[0]
+        own_rate = connection.rates[1] if reverse else connection.rates[0]
+        def oriented(path):
+            return path[::-1] if reverse else path
+
+        current_residual = self._path_residual(oriented(connection.path),own_rate)
+        best_path = None
+        best_residual = current_residual * (1 + costants['elephant_reroute_gain'])
+        for path in self._near_equal_cost_paths(src,dst):
+            if path == connection.path:
+                continue
+            residual = self._path_residual(oriented(path))
+            if residual > best_residual:
+                best_path = path
+                best_residual = residual
+
+        if best_path is None:
+            return
+        print_debug("{}  {}ELEPHANT FLOW {}Moving connection {}:{} -> {}:{} ({} bps) to the path: {}",costants['path_emote'],costants['ansi_magenta'],costants['ansi_white'],
+            connection.src_ip,connection.src_port,connection.dst_ip,connection.dst_port,int(own_rate),PathText(best_path,src,dst))
+        self.move_connection(connection,best_path)
+
+    #Make before break: the rules of the new path are installed on every switch but the ingress ones, and only when
+    #all the switches have confirmed them the ingress switches of both directions are moved to the new path.
+    #The rules left on the switches of the old path expire with the idle timeout
+    def move_connection(self,connection,path):
+        src = path[0]
+        dst = path[-1]
+        datapaths = [self._get_datapath(dpid) for dpid in path]
+        if None in datapaths:
+            return
+        connection.moved_at = time.time()
+
+        #the ports toward the hosts do not change
+        hops = self._path_hops(path,connection.hops[src][1],connection.hops[dst][0])
+        def matches(datapath):
+            parser = datapath.ofproto_parser
+            return (self._connection_match(parser,connection.proto,connection.src_ip,connection.dst_ip,connection.src_port,connection.dst_port),
+                    self._connection_match(parser,connection.proto,connection.dst_ip,connection.src_ip,connection.dst_port,connection.src_port))
+
+        for datapath in datapaths:
+            parser = datapath.ofproto_parser
+            forward_match, reverse_match = matches(datapath)
+            forward_port, reverse_port = hops[datapath.id]
+            if datapath.id != src:
+                self.send_connection_flow_mod(datapath,parser,forward_match,[parser.OFPActionOutput(forward_port)],connection)
+            if datapath.id != dst:
+                self.send_connection_flow_mod(datapath,parser,reverse_match,[parser.OFPActionOutput(reverse_port)],connection,True)
+
+        def switch_ingress():
+            ingress_src = datapaths[0]
+            ingress_dst = datapaths[-1]
+            forward_match, _ = matches(ingress_src)
+            _, reverse_match = matches(ingress_dst)
+            self.send_connection_flow_mod(ingress_src,ingress_src.ofproto_parser,forward_match,[ingress_src.ofproto_parser.OFPActionOutput(hops[src][0])],connection)
+            self.send_connection_flow_mod(ingress_dst,ingress_dst.ofproto_parser,reverse_match,[ingress_dst.ofproto_parser.OFPActionOutput(hops[dst][1])],connection,True)
+            self.connections.set_path(connection,path,hops)
+            if self.share_connections:
+                self.cluster.update_connection(connection.key(),path,hops)
+
+        self.dispatcher.after(datapaths,switch_ingress)
+
     #Event handler executed when a packet in message is received from a switch and the packet is a TCP or UDP packet
-    def _packet_in_not_TCP_or_UDP_handler(self,msg,datapath,parser,ofproto,in_port,eth):
-        dst = eth.dst
+    @HANDLER_LATENCY.time('other')
+    def _packet_in_not_TCP_or_UDP_handler(self,msg,datapath,parser,ofproto,in_port,headers):
+        dst = headers.eth_dst
         dst_switch, out_port = self._find_destination_switch(dst)
 
         if dst_switch is None or out_port is None:
@@ -399,7 +791,8 @@ class RyuController(app_manager.RyuApp):
             data=msg.data
         )
 
-        datapath.send_msg(out)
+        #the packet is forwarded after the flow entry has been installed
+        self.dispatcher.send_after_barrier(datapath,out)
 
         #adding the flow entry to the next packet
         match = parser.OFPMatch(
@@ -417,36 +810,30 @@ class RyuController(app_manager.RyuApp):
             instructions=inst
         )
 
-        datapath.send_msg(mod)
+        self.dispatcher.send(datapath,mod)
+        FLOW_MODS.inc(1,5)
 
     #Event handler executed when a packet in message is received from a switch and the packet is an ARP packet
-    def proxy_arp_handler(self,msg,datapath,parser,ofproto,in_port,eth):
-        #Getting the packet in message
-        pkt = packet.Packet(msg.data)
-        #get the arp packet
-        arp_pkt = pkt.get_protocol(arp.arp)
-        
+    @HANDLER_LATENCY.time('arp')
+    def proxy_arp_handler(self,msg,datapath,parser,ofproto,in_port,headers):
+        self.host_table.learn_ip(headers.arp_src_ip,headers.arp_src_mac)
+
         #If it's not an ARP request, ignore the packet
-        if arp_pkt.opcode != arp.ARP_REQUEST:
+        if headers.arp_opcode != arp.ARP_REQUEST:
             return
 
         #Getting the destination MAC address
-        dst_mac = None
-
-        for host in get_all_host(self):
-            if arp_pkt.dst_ip in host.ipv4:
-                dst_mac = host.mac
-                break
+        dst_mac = self.host_table.mac(headers.arp_dst_ip)
 
         if dst_mac is None:
-            print_debug("Destination MAC address not found for arp request with ip: {}".format(arp_pkt.dst_ip))
+            print_debug("Destination MAC address not found for arp request with ip: {}".format(headers.arp_dst_ip))
             return
         
         #creating a packet out message
         packet_out = packet.Packet()
 
         eth_out = ethernet.ethernet(
-            dst = eth.src,
+            dst = headers.eth_src,
             src = dst_mac,
             ethertype = ether_types.ETH_TYPE_ARP
         )
@@ -454,9 +841,9 @@ class RyuController(app_manager.RyuApp):
         arp_out = arp.arp(
             opcode = arp.ARP_REPLY,
             src_mac = dst_mac,
-            src_ip = arp_pkt.dst_ip,
-            dst_mac = arp_pkt.src_mac,
-            dst_ip = arp_pkt.src_ip
+            src_ip = headers.arp_dst_ip,
+            dst_mac = headers.arp_src_mac,
+            dst_ip = headers.arp_src_ip
         )
 
         packet_out.add_protocol(eth_out)
@@ -477,23 +864,17 @@ class RyuController(app_manager.RyuApp):
 
     #Find the switch and port where the destination host is connected to
     def _find_destination_switch(self,dst): 
-        for host in get_all_host(self):
-            if host.mac == dst:
-                return (host.port.dpid,host.port.port_no)
-        return (None,None)
+        return self.host_table.location(dst)
     
     #Find the next hop to the destination switch
     def _find_next_hop_to_destination(self,source_id,destination_id):
-        net = nx.DiGraph()
-        for link in get_all_link(self):
-            net.add_edge(link.src.dpid, link.dst.dpid, port=link.src.port_no)
         try:
             path = nx.shortest_path(
-                net,
+                self.net,
                 source_id,
                 destination_id
             )
-            first_link = net[ path[0] ][ path[1] ]
+            first_link = self.net[ path[0] ][ path[1] ]
             return first_link['port']
         except nx.NetworkXNoPath:
             print_error("No path found from {} to {}".format(source_id,destination_id))
@@ -504,49 +885,32 @@ class RyuController(app_manager.RyuApp):
             return None
 
     @set_ev_cls(ofp_event.EventOFPPortStatsReply, MAIN_DISPATCHER)
+    @STATS_LATENCY.time('port_stats')
     def flow_stats_reply_handler(self, ev):
+        dpid = ev.msg.datapath.id
+        timestamp = time.time()
         for stat in ev.msg.body:
             if stat.port_no == 4294967294: #4294967294 is the special port number for the entire switch
                 continue
-            #I should find the dst switch and port
-            found = False
-            dst_id = None
-            for link in get_all_link(self):
-                if link.src.dpid == ev.msg.datapath.id:
-                    if link.src.port_no == stat.port_no:
-                        found = True
-                        dst_id = link.dst.dpid
-                        break
-            
-            if not found: #if the port is not found, the connection is a switch-host connection
+            #I should find the dst switch
+            dst_id = self.port_peers.get((dpid,stat.port_no))
+            if dst_id is None: #if the port is not found, the connection is a switch-host connection
                 continue
 
-            link = "{}:{}".format(ev.msg.datapath.id,dst_id)
-            if link not in self.switch_stats.keys():
-                self.switch_stats[link] = list()
-
-            temp = dict()
-            temp['rx_bytes'] = stat.rx_bytes
-            temp['tx_bytes'] = stat.tx_bytes
-            temp['timestamp'] = time.time()
-
-            if len(self.switch_stats[link]) > 0:
-                #calculate the bandwidth
-                prev = self.switch_stats[link][-1]
-                duration = temp['timestamp'] - prev['timestamp']
-                if duration == 0:
-                    duration = 1
-                #bandwidth in bits per second
-                temp['bandwidth'] = (temp['rx_bytes'] + temp['tx_bytes'] - prev['rx_bytes'] - prev['tx_bytes']) * 8 / duration
-
-            self.switch_stats[link].append(temp)            
-            #remove old data from the list
-            if len(self.switch_stats[link]) > 2:
-                self.switch_stats[link].pop(0)
-            
+            stats = self.switch_stats.get((dpid,dst_id))
+            if stats is None:
+                stats = LinkStats(costants['stats_window'],costants['ewma_alpha'])
+                self.switch_stats[(dpid,dst_id)] = stats
+            stats.add(timestamp,stat.rx_bytes,stat.tx_bytes)
+
             # Log the statistics
-            self.logger.debug("Switch id: {} Port: {} Rx Packets: {}, Tx Packets: {}, Rx Bytes: {}, Tx Bytes: {}, Rx Errors: {}, Tx Errors: {}, Rx Dropped: {}, Tx Dropped: {}, Collisions: {}, Duration Sec: {}, Duration Nsec: {}".format(
-                ev.msg.datapath.id, stat.port_no,stat.rx_packets, stat.tx_packets, stat.rx_bytes, stat.tx_bytes, stat.rx_errors, stat.tx_errors, stat.rx_dropped, stat.tx_dropped, stat.collisions, stat.duration_sec, stat.duration_nsec))
+            #formatted only if the debug level is enabled, by the log sink thread
+            self.logger.debug("Switch id: %s Port: %s Rx Packets: %s, Tx Packets: %s, Rx Bytes: %s, Tx Bytes: %s, Rx Errors: %s, Tx Errors: %s, Rx Dropped: %s, Tx Dropped: %s, Collisions: %s, Duration Sec: %s, Duration Nsec: %s",
+                dpid, stat.port_no,stat.rx_packets, stat.tx_packets, stat.rx_bytes, stat.tx_bytes, stat.rx_errors, stat.tx_errors, stat.rx_dropped, stat.tx_dropped, stat.collisions, stat.duration_sec, stat.duration_nsec)
+
+        #the new measurements change the cost of the links of this switch
+        if costants['cost_protocol'] == 'DYNAMIC_BANDWIDTH':
+            self.refresh_dynamic_weights(dpid)
 
     @set_ev_cls(ofp_event.EventOFPPortDescStatsReply, MAIN_DISPATCHER)
     def stats_speed_reply(self,ev):
@@ -554,9 +918,22 @@ class RyuController(app_manager.RyuApp):
             if p.port_no == 4294967294: #4294967294 is the special port number for the entire switch
                 continue
             
-            link = "{}:{}".format(ev.msg.datapath.id,p.port_no)
-            self.nominal_bandwidth[link] = p.curr_speed * 1000 #kbps to bps
-            self.logger.debug("Switch id: {} Port: {} HwAddr: {} Name: {} Config: {} State: {} Curr: {} Advertised: {} Supported: {} Peer: {} Curr Speed: {} Max Speed: {}".format(ev.msg.datapath.id,p.port_no,p.hw_addr,p.name,p.config,p.state,p.curr,p.advertised,p.supported,p.peer,p.curr_speed,p.max_speed))
+            self.nominal_bandwidth[(ev.msg.datapath.id,p.port_no)] = p.curr_speed * 1000 #kbps to bps
+            self.logger.debug("Switch id: %s Port: %s HwAddr: %s Name: %s Config: %s State: %s Curr: %s Advertised: %s Supported: %s Peer: %s Curr Speed: %s Max Speed: %s",ev.msg.datapath.id,p.port_no,p.hw_addr,p.name,p.config,p.state,p.curr,p.advertised,p.supported,p.peer,p.curr_speed,p.max_speed)
+
+        #outside debug mode the OSPF/DYNAMIC_BANDWIDTH costs depend on the nominal bandwidth of the ports
+        self._update_link_bandwidth(ev.msg.datapath.id)
+
+    #Event handler executed when a port of a switch is added, removed or modified
+    @set_ev_cls(ofp_event.EventOFPPortStatus, MAIN_DISPATCHER)
+    def port_status_handler(self, ev):
+        msg = ev.msg
+        dpid = msg.datapath.id
+        if msg.reason == msg.datapath.ofproto.OFPPR_DELETE:
+            self.nominal_bandwidth.pop((dpid,msg.desc.port_no),None)
+        else:
+            self.nominal_bandwidth[(dpid,msg.desc.port_no)] = msg.desc.curr_speed * 1000 #kbps to bps
+        self._update_link_bandwidth(dpid)
 
     #Cost function using hop count
     def cost_function_using_hop_count(self,src,dst):
@@ -564,128 +941,488 @@ class RyuController(app_manager.RyuApp):
 
     #Cost function using OSPF
     def cost_function_using_OSPF(self,src,dst):
-        bandwidth = self._load_nominal_bandwidth()
-
-        link_name = "{}:{}".format(src,dst)
-        if link_name not in bandwidth.keys():
-            print_debug("Link {} not found in the nominal bandwidth list".format(link_name))
+        if (src,dst) not in self.link_bandwidth:
+            print_debug("Link {}:{} not found in the nominal bandwidth list".format(src,dst))
             return costants['OSPF_reference_bandwidth']
         
-        cost = float(costants['OSPF_reference_bandwidth']) / float(bandwidth[link_name])
+        cost = float(costants['OSPF_reference_bandwidth']) / float(self.link_bandwidth[(src,dst)])
         return cost
 
     #Cost function using dynamic bandwidth
     def cost_function_using_dynamic_bandwidth(self,src,dst):
-        bandwidth = self._load_nominal_bandwidth()
-
-        link_name = "{}:{}".format(src,dst)
-        if link_name not in bandwidth.keys():
-            print_debug("Link {} not found in the nominal bandwidth list".format(link_name))
+        if (src,dst) not in self.link_bandwidth:
+            print_debug("Link {}:{} not found in the nominal bandwidth list".format(src,dst))
             return costants['OSPF_reference_bandwidth']
         
         # cost = OSPF reference bandwidth / actual free bandwidth
-        nominal_bandwidth = bandwidth[link_name]
-        try:
-            current_used_bandwidth = self.switch_stats[link_name][-1]['bandwidth']
-        except Exception:
-            current_used_bandwidth = 0
+        nominal_bandwidth = self.link_bandwidth[(src,dst)]
+        current_used_bandwidth = self.link_utilization(src,dst)
         
-        available_bandwidth = nominal_bandwidth - current_used_bandwidth
+        #a saturated link gets the highest cost instead of a negative one
+        available_bandwidth = max(nominal_bandwidth - current_used_bandwidth, 1)
         cost = float(costants['OSPF_reference_bandwidth']) / float(available_bandwidth)
         return cost
     
-    #This function return 
-    def _load_nominal_bandwidth(self):
-        bandwidth = dict()
-        if costants['debug']:
-            #Load nominal bandwidth from file
+    #Estimated load in bits per second of the link from src to dst, using the estimator chosen in the constants file.
+    #The load of the link is measured on the transmitted bytes of the port of the source switch
+    def link_utilization(self,src,dst):
+        stats = self.switch_stats.get((src,dst))
+        if stats is None:
+            return 0
+        return stats.utilization(costants['utilization_estimator'],'tx',costants['utilization_percentile'])
+
+    #Highest utilization (0-1) of the links leaving a switch, used by the stats monitor to adapt the polling interval
+    def switch_utilization(self,dpid):
+        if dpid not in self.net:
+            return 0
+        utilization = 0
+        for dst in self.net[dpid]:
+            bandwidth = self.link_bandwidth.get((dpid,dst))
+            if bandwidth:
+                utilization = max(utilization, self.link_utilization(dpid,dst) / float(bandwidth))
+        return utilization
+
+    #Gauges and counters of the /metrics endpoint, read from the state of the controller when the metrics are requested
+    def metrics_gauges(self):
+        lines = list()
+        lines += gauge('sdn_connections_active','Connections in the connection table',[((),self.connections.active())])
+        lines += counter('sdn_connections_expired_total','Connections whose rules have expired',[((),self.connections.expired)])
+        lines += gauge('sdn_installed_rules','Connection rules installed on the switch',
+            [((('switch',dpid),),count) for dpid, count in sorted(self.installed_rules.items())])
+        lines += counter('sdn_path_cache_hits_total','Path lookups answered by the path cache',[((),self.path_cache.hits)])
+        lines += counter('sdn_path_cache_misses_total','Path lookups that computed the paths',[((),self.path_cache.misses)])
+        lines += counter('sdn_dispatcher_batches_total','Batches of messages written to the switches',[((),self.dispatcher.batches)])
+        lines += counter('sdn_dispatcher_messages_total','Messages written to the switches through the dispatcher',[((),self.dispatcher.messages)])
+        lines += gauge('sdn_install_latency_seconds','Average time between a batch of flow mods and its barrier reply',
+            [((('switch',dpid),),latency.average) for dpid, latency in sorted(self.dispatcher.latency.items())])
+        lines += counter('sdn_log_dropped_total','Log messages dropped because the log queue was full',[((),log_sink.dropped)])
+
+        utilization = list()
+        ratio = list()
+        for (src,dst) in sorted(self.switch_stats.keys()):
+            labels = (('src',src),('dst',dst))
+            value = self.link_utilization(src,dst)
+            utilization.append((labels,value))
+            bandwidth = self.link_bandwidth.get((src,dst))
+            if bandwidth:
+                ratio.append((labels,value / float(bandwidth)))
+        lines += gauge('sdn_link_utilization_bps','Estimated utilization of the link in bits per second',utilization)
+        lines += gauge('sdn_link_utilization_ratio','Estimated utilization of the link over its nominal bandwidth',ratio)
+        return lines
+
+    #Debug mode: load the nominal bandwidth of the links from the topology file, once
+    def _load_nominal_bandwidth_from_file(self):
+        try:
+            path = get_file_path(__file__ , "../config/{}/switches.json".format(costants['topology_folder_location']))
+            file = open(path,'r')
+            json_data = json.load(file)
+            file.close()
+            for switch in json_data['switches']:
+                switch_id = int(str(switch['id'])[1:])
+                for connected_switch in switch['connected_switches']:
+                    connected_switch_id = int(str(connected_switch['switchid'])[1:])
+                    link_bw_s = int(connected_switch['bw']) #mbps
+                    link_bw_b = link_bw_s * 1000000
+                    self.link_bandwidth[(switch_id,connected_switch_id)] = link_bw_b
+                    self.link_bandwidth[(connected_switch_id,switch_id)] = link_bw_b
+        except Exception as e:
+            print_error("Received exception {} while loading switches from JSON file".format(str(e)))
+            print_error("Traceback: {}".format(traceback.format_exc()))
+            exit(1)
+
+    #Outside debug mode the nominal bandwidth of a link is the speed of the port of the source switch
+    def _port_bandwidth(self,dpid,port_no):
+        if (dpid,port_no) not in self.nominal_bandwidth:
+            print_debug("Port {}:{} not found in the nominal bandwidth list, using DEFAULT cost".format(dpid,port_no))
+            return costants['OSPF_reference_bandwidth']
+        return self.nominal_bandwidth[(dpid,port_no)]
+
+    #Update the nominal bandwidth of the links leaving a switch after its ports have changed
+    def _update_link_bandwidth(self,dpid):
+        if costants['debug'] or dpid not in self.net:
+            return
+        changed = False
+        for dst, link in self.net[dpid].items():
+            bandwidth = self._port_bandwidth(dpid,link['port'])
+            if self.link_bandwidth.get((dpid,dst)) != bandwidth:
+                self.link_bandwidth[(dpid,dst)] = bandwidth
+                changed = True
+        if changed:
+            self.refresh_link_weights(dpid)
+
+    #Match a specific tcp/udp connection, 0 and '' are wildcards (see the rule granularity)
+    def _connection_match(self,parser,proto,src_ip,dst_ip,src_port,dst_port):
+        fields = dict()
+        fields['eth_type'] = ether_types.ETH_TYPE_IP
+        if proto == 6:
+            fields['ip_proto'] = 6
+            fields['tcp_src'] = src_port
+            fields['tcp_dst'] = dst_port
+        elif proto == 17:
+            fields['ip_proto'] = 17
+            fields['udp_src'] = src_port
+            fields['udp_dst'] = dst_port
+        if src_ip:
+            fields['ipv4_src'] = src_ip
+        fields['ipv4_dst'] = dst_ip
+        return parser.OFPMatch(**fields)
+
+    #Get the datapath instance of a switch given its id
+    def _get_datapath(self,dpid):
+        switch = get_switch(self,dpid)
+        if len(switch) == 0:
+            return None
+        return switch[0].dp
+
+    #Cost of a link according to the cost protocol
+    def link_cost(self,src,dst):
+        if costants['cost_protocol'] == 'HOP':
+            return self.cost_function_using_hop_count(src,dst)
+        elif costants['cost_protocol'] == 'OSPF':
+            return self.cost_function_using_OSPF(src,dst)
+        elif costants['cost_protocol'] == 'DYNAMIC_BANDWIDTH':
+            return self.cost_function_using_dynamic_bandwidth(src,dst)
+        print_debug("Cost function not found, using default cost function (hop count)...")
+        return 1
+
+    #Recompute the weight of the links of the graph, only the links of the given switch if dpid is not None
+    def refresh_link_weights(self,dpid=None):
+        if costants['cost_protocol'] == 'HOP':
+            return
+        if dpid is None:
+            edges = list(self.net.edges())
+        elif dpid in self.net:
+            edges = list(self.net.out_edges(dpid)) + list(self.net.in_edges(dpid))
+        else:
+            return
+        changed = False
+        for src, dst in edges:
+            weight = self.link_cost(src,dst)
+            if weight != self.net[src][dst]['weight']:
+                self.net[src][dst]['weight'] = weight
+                changed = True
+        if changed:
+            self.path_cache.weights_changed()
+
+    #Update in place the weight of the links of a switch using the last measured utilization.
+    #The links are re-weighted at most once every weight_refresh_period seconds, and only if the cost changed
+    #more than weight_hysteresis (relative to the current weight), so noisy samples do not move the paths around
+    def refresh_dynamic_weights(self,dpid):
+        if dpid not in self.net:
+            return
+        now = time.time()
+        if now - self.last_weight_refresh.get(dpid,0) < costants['weight_refresh_period']:
+            return
+        self.last_weight_refresh[dpid] = now
+
+        changed = False
+        for src, dst in list(self.net.out_edges(dpid)):
+            old_weight = self.net[src][dst]['weight']
+            new_weight = self.cost_function_using_dynamic_bandwidth(src,dst)
+            if abs(new_weight - old_weight) > costants['weight_hysteresis'] * old_weight:
+                print_debug("Link {} -> {} weight changed from {} to {}".format(src,dst,old_weight,new_weight))
+                self.net[src][dst]['weight'] = new_weight
+                changed = True
+        if changed:
+            self.path_cache.weights_changed()
+
+    #Event handler executed when a new host is discovered
+    @set_ev_cls(event.EventHostAdd)
+    def host_add_handler(self, ev):
+        print_debug("Host {} connected to switch {} port {}".format(ev.host.mac,ev.host.port.dpid,ev.host.port.port_no))
+        self.host_table.add(ev.host)
+
+    #Event handler executed when a host is connected to another switch port
+    @set_ev_cls(event.EventHostMove)
+    def host_move_handler(self, ev):
+        print_debug("Host {} moved to switch {} port {}".format(ev.dst.mac,ev.dst.port.dpid,ev.dst.port.port_no))
+        self.host_table.add(ev.dst)
+
+    @set_ev_cls(event.EventHostDelete)
+    def host_delete_handler(self, ev):
+        print_debug("Host {} removed".format(ev.host.mac))
+        self.host_table.remove(ev.host)
+
+    #Event handler executed when a switch joins the topology
+    @set_ev_cls(event.EventSwitchEnter)
+    def switch_enter_handler(self, ev):
+        dpid = ev.switch.dp.id
+        print_debug("Switch {} added to the network graph".format(dpid))
+        self.net.add_node(dpid)
+
+        #a (re)connected switch has no groups, they have to be programmed again
+        if costants['forwarding_mode'] == 'SELECT_GROUP':
+            self._forget_ecmp_state(dpid)
+            self.ecmp_programmed = None
+
+    #Event handler executed when a switch leaves the topology, its links are removed too
+    @set_ev_cls(event.EventSwitchLeave)
+    def switch_leave_handler(self, ev):
+        dpid = ev.switch.dp.id
+        print_debug("Switch {} removed from the network graph".format(dpid))
+        #the flow table of the switch is lost
+        self.installed_rules.pop(dpid,None)
+        for port in [port for port in self.port_peers.keys() if port[0] == dpid]:
+            del self.port_peers[port]
+        if dpid in self.net:
+            self.net.remove_node(dpid)
+            self.path_cache.topology_changed()
+        if costants['forwarding_mode'] == 'SELECT_GROUP':
+            self._ecmp_switch_down(dpid)
+
+    #Event handler executed when a new link between two switches is discovered
+    @set_ev_cls(event.EventLinkAdd)
+    def link_add_handler(self, ev):
+        link = ev.link
+        self._add_link(link.src.dpid,link.dst.dpid,link.src.port_no)
+        #clustered mode: only the owner of the destination switch publishes the link
+        if self.cluster is not None and self.cluster.owns(link.dst.dpid):
+            self.cluster.put_link(link.src.dpid,link.dst.dpid,link.src.port_no)
+
+    #Event handler executed when a link between two switches goes down
+    @set_ev_cls(event.EventLinkDelete)
+    def link_delete_handler(self, ev):
+        link = ev.link
+        self._remove_link(link.src.dpid,link.dst.dpid,link.src.port_no)
+        if self.cluster is not None and self.cluster.owns(link.dst.dpid):
+            self.cluster.delete_link(link.src.dpid,link.dst.dpid)
+
+    def _add_link(self,src,dst,port_no):
+        print_debug("Link {} -> {} added to the network graph".format(src,dst))
+        if not costants['debug']:
+            self.link_bandwidth[(src,dst)] = self._port_bandwidth(src,port_no)
+        weight = self.link_cost(src,dst)
+        self.net.add_edge(src, dst, port=port_no, weight=weight)
+        self.port_peers[(src,port_no)] = dst
+        self.path_cache.topology_changed()
+
+    def _remove_link(self,src,dst,port_no):
+        print_debug("Link {} -> {} removed from the network graph".format(src,dst))
+        self.port_peers.pop((src,port_no),None)
+        self.switch_stats.pop((src,dst),None)
+        if self.net.has_edge(src,dst):
+            self.net.remove_edge(src,dst)
+            self.path_cache.topology_changed()
+        if costants['forwarding_mode'] == 'SELECT_GROUP':
+            self._ecmp_link_down(src,port_no)
+
+    #Clustered mode: every cluster_sync_interval seconds the hosts and the link load of this controller are published
+    #with the queued writes in a single transaction, and the links, the hosts and the link load of the other
+    #controllers are imported with a single read
+    def _cluster_sync(self):
+        while True:
+            hub.sleep(costants['cluster_sync_interval'])
             try:
-                path = get_file_path(__file__ , "../config/{}/switches.json".format(costants['topology_folder_location']))
-                file = open(path,'r')
-                json_data = json.load(file)
-                file.close()
-                for switch in json_data['switches']:
-                    switch_id = str(switch['id'])[1:]
-                    for connected_switch in switch['connected_switches']:
-                        connected_switch_id = str(connected_switch['switchid'])[1:]
-                        link_bw_s = int(connected_switch['bw']) #mbps
-                        link_bw_b = link_bw_s * 1000000
-                        bandwidth["{}:{}".format(switch_id,connected_switch_id)] = link_bw_b
-                        bandwidth["{}:{}".format(connected_switch_id,switch_id)] = link_bw_b
+                self._publish_hosts()
+                if self.share_connections:
+                    self._publish_link_load()
+                self.cluster.flush_writes()
+                links, hosts, load = self.cluster.call(self.cluster.remote_state)
+                self._sync_links(links)
+                self._sync_hosts(hosts)
+                if self.share_connections:
+                    #the connections loaded from the store are not counted by the connection table
+                    self.connections.remote_links = load
             except Exception as e:
-                print_error("Received exception {} while loading switches from JSON file".format(str(e)))
+                print_error("Received exception {} while synchronizing the cluster state".format(str(e)))
                 print_error("Traceback: {}".format(traceback.format_exc()))
-                exit(1)
+
+    #A link is discovered only by the owner of its destination switch, the LLDP packets reach only that controller
+    def _sync_links(self,links):
+        remote = dict(((src,dst),port) for src, dst, port in links)
+        for (src,dst), port in remote.items():
+            if src in self.net and dst in self.net and not self.net.has_edge(src,dst):
+                self._add_link(src,dst,port)
+        for src, dst, port in list(self.net.edges(data='port')):
+            if not self.cluster.owns(dst) and (src,dst) not in remote:
+                self._remove_link(src,dst,port)
+
+    #A host is discovered only by the owner of the switch where it is connected
+    def _publish_hosts(self):
+        addresses = self.host_table.addresses()
+        local = dict()
+        for mac, (dpid, port) in list(self.host_table.locations.items()):
+            if self.cluster.owns(dpid):
+                local[mac] = (dpid, port, sorted(addresses.get(mac,[])))
+        for mac, host in local.items():
+            if self.cluster_published.get(mac) != host:
+                self.cluster.put_host(mac,*host)
+        for mac in set(self.cluster_published) - set(local):
+            self.cluster.delete_host(mac)
+        self.cluster_published = local
+
+    def _sync_hosts(self,hosts):
+        remote = dict()
+        for mac, dpid, port, ipv4 in hosts:
+            remote[mac] = (dpid, port, ipv4)
+            if self.cluster_imported.get(mac) != remote[mac]:
+                self.host_table.place(mac,dpid,port,ipv4)
+        for mac in set(self.cluster_imported) - set(remote):
+            dpid, port, ipv4 = self.cluster_imported[mac]
+            #a host that has moved to a switch of this controller is kept
+            if self.host_table.location(mac) == (dpid, port):
+                self.host_table.discard(mac,ipv4)
+        self.cluster_imported = remote
+
+    #The connections of this controller count in the load of the links used by the other controllers, only the
+    #links whose number of connections has changed are written
+    def _publish_link_load(self):
+        links = dict(self.connections.links)
+        for (src,dst), count in links.items():
+            if self.cluster_published_load.get((src,dst)) != count:
+                self.cluster.put_link_load(src,dst,count)
+        for src, dst in set(self.cluster_published_load) - set(links):
+            self.cluster.put_link_load(src,dst,0)
+        self.cluster_published_load = links
+
+    #SELECT_GROUP forwarding mode: reprogram the select groups and the host rules when the graph or the hosts change.
+    #The changes are coalesced, so a burst of topology events is programmed only once
+    def _ecmp_monitor(self):
+        while True:
+            hub.sleep(costants['ecmp_update_period'])
+            state = (self.path_cache.topology_epoch,self.path_cache.weight_epoch,self.host_table.version)
+            if state == self.ecmp_programmed:
+                continue
+            try:
+                self.program_ecmp()
+                self.dispatcher.flush()
+                self.ecmp_programmed = state
+            except Exception as e:
+                print_error("Received exception {} while programming the select groups".format(str(e)))
+                print_error("Traceback: {}".format(traceback.format_exc()))
+
+    #Install on every switch a select group for every destination switch, with a bucket for every equal cost next hop,
+    #and a rule for every host that sends its packets to the group of the switch where the host is connected
+    def program_ecmp(self):
+        print_debug("Programming select groups")
+        datapaths = dict()
+        for dpid in list(self.net.nodes()):
+            datapath = self._get_datapath(dpid)
+            if datapath is not None:
+                datapaths[dpid] = datapath
+
+        #clustered mode: every controller programs only its own switches
+        programmed = dict((dpid,datapath) for dpid, datapath in datapaths.items() if self.cluster is None or self.cluster.owns(dpid))
+
+        for dst in datapaths.keys():
+            next_hops = equal_cost_next_hops(self.net,dst)
+            for dpid, datapath in programmed.items():
+                if dpid == dst:
+                    continue
+                hops = next_hops.get(dpid)
+                if hops is None:
+                    self._delete_ecmp_group(datapath,dst)
+                    continue
+                weights = bucket_weights([cost for _, _, cost in hops])
+                buckets = tuple((port,weight) for (_, port, _), weight in zip(hops,weights))
+                self._send_ecmp_group(datapath,dst,buckets)
+
+        for mac, (host_dpid, host_port) in list(self.host_table.locations.items()):
+            for dpid, datapath in programmed.items():
+                if dpid == host_dpid:
+                    action = ('port',host_port)
+                elif (dpid,host_dpid) in self.ecmp_groups:
+                    action = ('group',host_dpid)
+                else:
+                    continue
+                if self.ecmp_host_rules.get((dpid,mac)) == action:
+                    continue
+                self._send_ecmp_host_rule(datapath,mac,action)
+
+    #Add or modify the select group of a switch toward a destination switch, the group id is the destination dpid
+    def _send_ecmp_group(self,datapath,dst,buckets):
+        previous = self.ecmp_groups.get((datapath.id,dst))
+        if previous == buckets:
+            return
+        ofproto = datapath.ofproto
+        parser = datapath.ofproto_parser
+        command = ofproto.OFPGC_ADD if previous is None else ofproto.OFPGC_MODIFY
+        ofp_buckets = [
+            parser.OFPBucket(weight=weight,watch_port=ofproto.OFPP_ANY,watch_group=ofproto.OFPG_ANY,actions=[parser.OFPActionOutput(port)])
+            for port, weight in buckets
+        ]
+        print_debug("Switch {} group toward switch {}: {}".format(datapath.id,dst,buckets))
+        datapath.send_msg(parser.OFPGroupMod(datapath,command,ofproto.OFPGT_SELECT,dst,ofp_buckets))
+        self.ecmp_groups[(datapath.id,dst)] = buckets
+
+    #Delete the select group of a switch toward a destination switch that cannot be reached anymore,
+    #the switch removes the rules that point to the group too
+    def _delete_ecmp_group(self,datapath,dst):
+        if self.ecmp_groups.pop((datapath.id,dst),None) is None:
+            return
+        ofproto = datapath.ofproto
+        parser = datapath.ofproto_parser
+        datapath.send_msg(parser.OFPGroupMod(datapath,ofproto.OFPGC_DELETE,ofproto.OFPGT_SELECT,dst))
+        for key, action in list(self.ecmp_host_rules.items()):
+            if key[0] == datapath.id and action == ('group',dst):
+                del self.ecmp_host_rules[key]
+
+    #Rule that forwards the packets for a host to its port or to the select group of its switch,
+    #its priority is higher than the TCP/UDP rules so new connections do not reach the controller
+    def _send_ecmp_host_rule(self,datapath,mac,action):
+        parser = datapath.ofproto_parser
+        match = parser.OFPMatch(eth_dst=mac)
+        if action[0] == 'port':
+            actions = [parser.OFPActionOutput(action[1])]
         else:
-            #Load nominal bandwidth from the network by getting the port description
-            for switch in get_all_switch(self):
-                for link in get_all_link(self):
-                    if link.src.dpid == switch.dp.id:
-                        try:
-                            link_bw = self.nominal_bandwidth["{}:{}".format(switch.dp.id,link.src.port_no)]    
-                            bandwidth["{}:{}".format(link.src.dpid,link.dst.dpid)] = link_bw
-                            bandwidth["{}:{}".format(link.dst.dpid,link.src.dpid)] = link_bw
-                        except Exception:
-                            print("Link {} not found in the nominal bandwidth list, using DEFAULT cost".format("{}:{}".format(switch.dp.id,link.src.port_no)))
-                            bandwidth["{}:{}".format(link.src.dpid,link.dst.dpid)] = costants['OSPF_reference_bandwidth']
-                            bandwidth["{}:{}".format(link.dst.dpid,link.src.dpid)] = costants['OSPF_reference_bandwidth']
-        return bandwidth
-
-    #Check if the path has been already calculated
-    def _path_already_exists(self,src_port,dst_port,src_ip,dst_ip):
-        for connection in self.connections:
-            if connection['src_port'] == src_port and connection['dst_port'] == dst_port and connection['src_ip'] == src_ip and connection['dst_ip'] == dst_ip:
-                return True
-            #I should check also the reverse path
-            if connection['src_port'] == dst_port and connection['dst_port'] == src_port and connection['src_ip'] == dst_ip and connection['dst_ip'] == src_ip:
-                return True
-
-        return False
-
-    def _find_connection(self,src_port,dst_port,src_ip,dst_ip,start_switch,dest_switch):
-        found = False
-        reverse = False
-        connection = None
-
-        for i in range(len(self.connections)):
-            connection = self.connections[i]
-            if connection['src_port'] == src_port and connection['dst_port'] == dst_port and connection['src_ip'] == src_ip and connection['dst_ip'] == dst_ip:
-                print("{}  Path: ".format(costants['path_emote']),end='')
-                print_path(connection['path'],start_switch,dest_switch)
-                found = True
-                break
-            #reverse path
-            if connection['src_port'] == dst_port and connection['dst_port'] == src_port and connection['src_ip'] == dst_ip and connection['dst_ip'] == src_ip:
-                print("{}  Path: ".format(costants['path_emote']),end='')
-                print_path(connection['path'],start_switch,dest_switch)
-                found = True
-                reverse = True
-                break
-        return (found,reverse,connection)
-
-    #Create the network graph using the network topology
-    def create_net_graph(self):
-        net = nx.DiGraph()
-        for link in get_all_link(self):
-            if costants['cost_protocol'] == 'HOP':
-                weight = self.cost_function_using_hop_count(link.src.dpid,link.dst.dpid)
-            elif costants['cost_protocol'] == 'OSPF':
-                weight = self.cost_function_using_OSPF(link.src.dpid,link.dst.dpid)
-            elif costants['cost_protocol'] == 'DYNAMIC_BANDWIDTH':
-                weight = self.cost_function_using_dynamic_bandwidth(link.src.dpid,link.dst.dpid)
+            actions = [parser.OFPActionGroup(action[1])]
+        self.send_odf_flow_mod(datapath,parser,match,actions,200)
+        self.ecmp_host_rules[(datapath.id,mac)] = action
+
+    #A switch has left: the groups toward it are deleted from the other switches at once, together with the host rules
+    #that point to them, without waiting for the next programming of the groups
+    def _ecmp_switch_down(self,dpid):
+        self._forget_ecmp_state(dpid)
+        for switch, dst in [key for key in self.ecmp_groups.keys() if key[1] == dpid]:
+            datapath = self._get_datapath(switch)
+            if datapath is None:
+                self.ecmp_groups.pop((switch,dst),None)
+                continue
+            self._delete_ecmp_group(datapath,dst)
+
+    #A link has gone down: the buckets that use its port are removed at once from the groups of the source switch,
+    #a group left without buckets is deleted
+    def _ecmp_link_down(self,dpid,port_no):
+        datapath = self._get_datapath(dpid)
+        if datapath is None:
+            return
+        for (switch, dst), buckets in list(self.ecmp_groups.items()):
+            if switch != dpid or all(port != port_no for port, _ in buckets):
+                continue
+            remaining = tuple((port,weight) for port, weight in buckets if port != port_no)
+            if remaining:
+                self._send_ecmp_group(datapath,dst,remaining)
             else:
-                weight = 1
-                print_debug("Cost function not found, using default cost function (hop count)...")
-            net.add_edge(link.src.dpid, link.dst.dpid, port=link.src.port_no, weight=weight)
-        return net
-    
-    def send_odf_flow_mod(self,datapath,parser,match,actions,priority):
-        print_debug("Sending flow mod to switch with datapath id: {}".format(datapath.id))
+                self._delete_ecmp_group(datapath,dst)
+
+    def _forget_ecmp_state(self,dpid):
+        for key in [key for key in self.ecmp_groups.keys() if key[0] == dpid]:
+            del self.ecmp_groups[key]
+        for key in [key for key in self.ecmp_host_rules.keys() if key[0] == dpid]:
+            del self.ecmp_host_rules[key]
+
+    def send_odf_flow_mod(self,datapath,parser,match,actions,priority,idle_timeout=0,hard_timeout=0,flags=0,cookie=0):
+        hot_log.debug("Sending flow mod to switch with datapath id: {}",datapath.id)
         ofproto = datapath.ofproto
         inst = [parser.OFPInstructionActions(ofproto.OFPIT_APPLY_ACTIONS, actions)]
-        mod = parser.OFPFlowMod(datapath=datapath, priority=priority, match=match, instructions=inst)
-        datapath.send_msg(mod)
+        mod = parser.OFPFlowMod(datapath=datapath, priority=priority, match=match, instructions=inst, cookie=cookie,
+                                idle_timeout=idle_timeout, hard_timeout=hard_timeout, flags=flags)
+        self.dispatcher.send(datapath,mod)
+        FLOW_MODS.inc(1,priority)
+
+    #Send the priority 1000 rule of a TCP/UDP connection, the rule expires after the configured timeouts
+    #and the switch notifies the controller with a flow removed message
+    def send_connection_flow_mod(self,datapath,parser,match,actions,connection,reverse=False):
+        self.send_odf_flow_mod(datapath,parser,match,actions,1000,
+            idle_timeout=costants['connection_idle_timeout'],
+            hard_timeout=costants['connection_hard_timeout'],
+            flags=datapath.ofproto.OFPFF_SEND_FLOW_REM,
+            cookie=CONNECTION_COOKIE)
+        if connection is not None and (datapath.id,reverse) not in connection.installed:
+            self.installed_rules[datapath.id] = self.installed_rules.get(datapath.id,0) + 1
+            connection.rule_installed(datapath.id,reverse)
     
+    #The packet out is processed by the switch after the flow mods sent before it
     def send_packet_out(self,datapath,parser,actions,in_port,msg):
         out = parser.OFPPacketOut(
             datapath=datapath,
@@ -694,4 +1431,4 @@ class RyuController(app_manager.RyuApp):
             actions=actions,
             data=msg.data
         )
-        datapath.send_msg(out)
\ No newline at end of file
+        self.dispatcher.send_after_barrier(datapath,out)
\ No newline at end of file
@@ -0,0 +1,131 @@
+'''
+    Performance counters of the controller, exported in the Prometheus text format.
+
+    Counters and histograms are updated by the handlers of the controller, the gauges (connection table size,
+    link utilization, ...) are read from the state of the controller only when the metrics are requested.
+    The metrics are served by the REST API of the controller (see rest_api.py) at /metrics.
+'''
+import bisect
+import functools
+import time
+
+#Upper bounds of the latency histograms, in seconds
+DEFAULT_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0)
+
+def _labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join('{}="{}"'.format(key, str(value).replace('\\', '\\\\').replace('"', '\\"')) for key, value in labels) + '}'
+
+def _header(name, help_text, metric_type):
+    return ['# HELP {} {}'.format(name, help_text), '# TYPE {} {}'.format(name, metric_type)]
+
+#Lines of a gauge, samples is a list of (((label name, label value), ...), value)
+def gauge(name, help_text, samples):
+    lines = _header(name, help_text, 'gauge')
+    for labels, value in samples:
+        lines.append('{}{} {}'.format(name, _labels(labels), value))
+    return lines
+
+#Lines of a counter read from the state of the controller, like gauge()
+def counter(name, help_text, samples):
+    lines = _header(name, help_text, 'counter')
+    for labels, value in samples:
+        lines.append('{}{} {}'.format(name, _labels(labels), value))
+    return lines
+
+class Counter:
+    def __init__(self, name, help_text, label=None):
+        self.name = name
+        self.help_text = help_text
+        self.label = label          #name of the label, None if the counter has no label
+        self.values = dict()        #label value -> count
+
+    def inc(self, value=1, label_value=None):
+        self.values[label_value] = self.values.get(label_value, 0) + value
+
+    def lines(self):
+        lines = _header(self.name, self.help_text, 'counter')
+        for label_value, value in sorted(self.values.items(), key=lambda item: str(item[0])):
+            labels = ((self.label, label_value),) if self.label is not None else ()
+            lines.append('{}{} {}'.format(self.name, _labels(labels), value))
+        return lines
+
+class Histogram:
+    def __init__(self, name, help_text, label=None, buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.label = label
+        self.buckets = tuple(buckets)
+        self.values = dict()        #label value -> [counts of every bucket (not cumulative) + overflow, sum]
+
+    def observe(self, value, label_value=None):
+        entry = self.values.get(label_value)
+        if entry is None:
+            entry = [[0] * (len(self.buckets) + 1), 0.0]
+            self.values[label_value] = entry
+        entry[0][bisect.bisect_left(self.buckets, value)] += 1
+        entry[1] += value
+
+    #Decorator that observes the execution time of a function
+    def time(self, label_value=None):
+        def decorator(function):
+            @functools.wraps(function)
+            def wrapper(*args, **kwargs):
+                start = time.perf_counter()
+                try:
+                    return function(*args, **kwargs)
+                finally:
+                    self.observe(time.perf_counter() - start, label_value)
+            return wrapper
+        return decorator
+
+    def lines(self):
+        lines = _header(self.name, self.help_text, 'histogram')
+        for label_value, (counts, total) in sorted(self.values.items(), key=lambda item: str(item[0])):
+            labels = ((self.label, label_value),) if self.label is not None else ()
+            cumulative = 0
+            for bound, count in zip(self.buckets + ('+Inf',), counts):
+                cumulative += count
+                lines.append('{}_bucket{} {}'.format(self.name, _labels(labels + (('le', bound),)), cumulative))
+            lines.append('{}_sum{} {}'.format(self.name, _labels(labels), total))
+            lines.append('{}_count{} {}'.format(self.name, _labels(labels), cumulative))
+        return lines
+
+class MetricsRegistry:
+    def __init__(self):
+        self.metrics = list()       #counters and histograms
+        self.collectors = list()    #functions returning the lines of the gauges
+
+    def counter(self, name, help_text, label=None):
+        metric = Counter(name, help_text, label)
+        self.metrics.append(metric)
+        return metric
+
+    def histogram(self, name, help_text, label=None, buckets=DEFAULT_BUCKETS):
+        metric = Histogram(name, help_text, label, buckets)
+        self.metrics.append(metric)
+        return metric
+
+    def add_collector(self, collector):
+        self.collectors.append(collector)
+
+    def remove_collector(self, collector):
+        self.collectors = [c for c in self.collectors if c != collector]
+
+    #Text exposition format of all the metrics
+    def render(self):
+        lines = list()
+        for metric in self.metrics:
+            lines.extend(metric.lines())
+        for collector in self.collectors:
+            lines.extend(collector())
+        return '\n'.join(lines) + '\n'
+
+registry = MetricsRegistry()
+
+#Metrics updated by the handlers of the controller
+HANDLER_LATENCY = registry.histogram('sdn_handler_duration_seconds', 'Execution time of the event handlers of the controller', 'handler')
+PATH_SELECTION_LATENCY = registry.histogram('sdn_path_selection_duration_seconds', 'Time spent choosing the path of a new connection')
+STATS_LATENCY = registry.histogram('sdn_stats_ingestion_duration_seconds', 'Time spent processing the statistics replies of the switches', 'reply')
+FLOW_MODS = registry.counter('sdn_flow_mods_total', 'Flow mod messages sent to the switches', 'priority')
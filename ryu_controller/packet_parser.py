@@ -0,0 +1,136 @@
+'''
+    Minimal packet in header parser.
+
+    The controller only needs a handful of fields of every packet in: ethertype, MAC addresses, IPv4 addresses,
+    IP protocol and TCP/UDP ports, or the fields of an ARP packet. They are read in a single pass with struct over a
+    memoryview of the packet data, without building the objects of every protocol layer like ryu packet.Packet does.
+    The parser object is reused for every packet in, and the addresses are converted to strings through a cache.
+    Packets that the parser does not handle (VLAN tags, IPv4 fragments, truncated packets) are decoded with the
+    ryu parser, which fills the same fields.
+'''
+import struct
+from ryu.lib.packet import packet, ethernet, ether_types, ipv4, tcp, udp, arp
+
+ETH_HEADER = struct.Struct('!HIHIH')        #dst mac (2+4 bytes), src mac (2+4 bytes), ethertype
+IPV4_HEADER = struct.Struct('!B8xB2xII')    #version/ihl, protocol, src, dst
+L4_PORTS = struct.Struct('!HH')
+ARP_HEADER = struct.Struct('!6xHHIIHII')    #opcode, sender mac, sender ip, target mac, target ip
+
+#Max number of cached addresses, the cache is emptied when it is full
+CACHE_SIZE = 65536
+
+_mac_cache = dict()
+_ip_cache = dict()
+
+def _mac(high, low):
+    value = (high << 32) | low
+    text = _mac_cache.get(value)
+    if text is None:
+        if len(_mac_cache) >= CACHE_SIZE:
+            _mac_cache.clear()
+        text = ':'.join('{:02x}'.format((value >> shift) & 0xff) for shift in range(40, -8, -8))
+        _mac_cache[value] = text
+    return text
+
+def _ip(value):
+    text = _ip_cache.get(value)
+    if text is None:
+        if len(_ip_cache) >= CACHE_SIZE:
+            _ip_cache.clear()
+        text = '{}.{}.{}.{}'.format(value >> 24, (value >> 16) & 0xff, (value >> 8) & 0xff, value & 0xff)
+        _ip_cache[value] = text
+    return text
+
+class PacketHeaders:
+    __slots__ = ('ethertype', 'eth_dst', 'eth_src', 'ip_proto', 'ipv4_src', 'ipv4_dst', 'src_port', 'dst_port',
+                 'arp_opcode', 'arp_src_mac', 'arp_src_ip', 'arp_dst_mac', 'arp_dst_ip')
+
+    def __init__(self):
+        self.clear()
+
+    def clear(self):
+        self.ethertype = None
+        self.eth_dst = None
+        self.eth_src = None
+        self.ip_proto = None
+        self.ipv4_src = None
+        self.ipv4_dst = None
+        self.src_port = None
+        self.dst_port = None
+        self.arp_opcode = None
+        self.arp_src_mac = None
+        self.arp_src_ip = None
+        self.arp_dst_mac = None
+        self.arp_dst_ip = None
+
+    #Read the headers of the packet, returns False if the packet is not an ethernet packet
+    def parse(self, data):
+        self.clear()
+        if not self._parse_fast(memoryview(data)):
+            return self._parse_ryu(data)
+        return True
+
+    #Returns False if the packet has to be decoded by the ryu parser
+    def _parse_fast(self, view):
+        try:
+            dst_high, dst_low, src_high, src_low, ethertype = ETH_HEADER.unpack_from(view, 0)
+            self.ethertype = ethertype
+            self.eth_dst = _mac(dst_high, dst_low)
+            self.eth_src = _mac(src_high, src_low)
+
+            if ethertype == ether_types.ETH_TYPE_IP:
+                version_ihl, proto, src, dst = IPV4_HEADER.unpack_from(view, 14)
+                if version_ihl >> 4 != 4:
+                    return False
+                self.ip_proto = proto
+                self.ipv4_src = _ip(src)
+                self.ipv4_dst = _ip(dst)
+                if proto == 6 or proto == 17:
+                    #fragments after the first one do not carry the ports, they are left to None
+                    flags_offset = struct.unpack_from('!H', view, 20)[0]
+                    if not flags_offset & 0x1fff:
+                        self.src_port, self.dst_port = L4_PORTS.unpack_from(view, 14 + (version_ihl & 0x0f) * 4)
+            elif ethertype == ether_types.ETH_TYPE_ARP:
+                opcode, sha_high, sha_low, spa, tha_high, tha_low, tpa = ARP_HEADER.unpack_from(view, 14)
+                self.arp_opcode = opcode
+                self.arp_src_mac = _mac(sha_high, sha_low)
+                self.arp_src_ip = _ip(spa)
+                self.arp_dst_mac = _mac(tha_high, tha_low)
+                self.arp_dst_ip = _ip(tpa)
+            elif ethertype == ether_types.ETH_TYPE_8021Q:
+                return False
+            return True
+        except struct.error:
+            return False
+
+    def _parse_ryu(self, data):
+        self.clear()
+        pkt = packet.Packet(data)
+        eth = pkt.get_protocol(ethernet.ethernet)
+        if eth is None:
+            return False
+        self.ethertype = eth.ethertype
+        self.eth_dst = eth.dst
+        self.eth_src = eth.src
+
+        ip = pkt.get_protocol(ipv4.ipv4)
+        if ip is not None:
+            self.ethertype = ether_types.ETH_TYPE_IP
+            self.ip_proto = ip.proto
+            self.ipv4_src = ip.src
+            self.ipv4_dst = ip.dst
+            #ryu decodes the payload of the fragments after the first one as a TCP/UDP header
+            l4 = None if ip.offset else pkt.get_protocol(tcp.tcp) or pkt.get_protocol(udp.udp)
+            if l4 is not None:
+                self.src_port = l4.src_port
+                self.dst_port = l4.dst_port
+
+        arp_pkt = pkt.get_protocol(arp.arp)
+        if arp_pkt is not None:
+            self.ethertype = ether_types.ETH_TYPE_ARP
+            self.arp_opcode = arp_pkt.opcode
+            self.arp_src_mac = arp_pkt.src_mac
+            self.arp_src_ip = arp_pkt.src_ip
+            self.arp_dst_mac = arp_pkt.dst_mac
+            self.arp_dst_ip = arp_pkt.dst_ip
+        return True
@@ -0,0 +1,51 @@
+'''
+    Cache of the equal cost paths between every pair of switches.
+
+    The paths of a (source switch, destination switch) pair are computed the first time a connection needs them and
+    reused by the next connections. The whole cache is dropped when the topology or the link weights change: every
+    change moves the corresponding epoch forward, so the setup of a new connection is a dictionary lookup in the
+    steady state.
+'''
+
+class PathCache:
+    def __init__(self):
+        self.paths = dict()         #(src dpid, dst dpid) -> list of equal cost paths
+        self.near_paths = dict()    #(src dpid, dst dpid) -> list of equal and near-equal cost paths (elephant rerouting)
+        self.topology_epoch = 0
+        self.weight_epoch = 0
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self.paths)
+
+    #Return the cached paths from src to dst, None if they have to be computed
+    def get(self, src, dst):
+        paths = self.paths.get((src, dst))
+        if paths is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return paths
+
+    def put(self, src, dst, paths):
+        self.paths[(src, dst)] = paths
+
+    #Return the cached near-equal cost paths from src to dst, None if they have to be computed
+    def get_near(self, src, dst):
+        return self.near_paths.get((src, dst))
+
+    def put_near(self, src, dst, paths):
+        self.near_paths[(src, dst)] = paths
+
+    #A switch or a link has been added or removed
+    def topology_changed(self):
+        self.topology_epoch += 1
+        self.paths.clear()
+        self.near_paths.clear()
+
+    #The weight of at least one link has changed
+    def weights_changed(self):
+        self.weight_epoch += 1
+        self.paths.clear()
+        self.near_paths.clear()
@@ -0,0 +1,28 @@
+'''
+    REST API of the controller, served by the WSGI server of Ryu (port 8080 by default, see the --wsapi-port option
+    of ryu-manager).
+
+    GET /metrics -> performance counters of the controller in the Prometheus text format
+    GET /hosts   -> hosts discovered by the controller, with the switch port where they are connected
+'''
+import json
+from ryu.app.wsgi import ControllerBase, route
+from webob import Response
+from metrics import registry
+
+class ControllerRestApi(ControllerBase):
+    def __init__(self, req, link, data, **config):
+        super(ControllerRestApi, self).__init__(req, link, data, **config)
+        self.controller = data['controller']
+
+    @route('metrics', '/metrics', methods=['GET'])
+    def metrics(self, req, **kwargs):
+        return Response(content_type='text/plain', charset='utf-8', text=registry.render())
+
+    @route('hosts', '/hosts', methods=['GET'])
+    def hosts(self, req, **kwargs):
+        host_table = self.controller.host_table
+        ips = host_table.addresses()
+        hosts = [{'mac': mac, 'ipv4': ips.get(mac, []), 'dpid': dpid, 'port': port}
+                 for mac, (dpid, port) in list(host_table.locations.items())]
+        return Response(content_type='application/json', charset='utf-8', text=json.dumps({'hosts': hosts}))
@@ -0,0 +1,348 @@
+'''
+    Flow level simulator of the data plane, used to compare the cost protocols without Mininet.
+
+    The network is built from the switches.json file of a topology folder (see benchmark.py) and the flows from its
+    traffic.json file. The routes are chosen by the real controller: the first packet of every flow is fed to the
+    packet in handler of a RyuController with stub switches, and the flow follows the rules the controller installs.
+    The controller receives the port statistics of the switches every stats_poll_interval simulated seconds and the
+    flow removed messages when the rules of finished connections expire, so the DYNAMIC_BANDWIDTH costs and the
+    path selection policies see the load of the simulated links.
+
+    The links share their capacity among the flows with max-min fairness (progressive filling). TCP flows take all the
+    bandwidth they can get, UDP flows are limited to --udp-rate (1 Mbps, the default rate of iperf3).
+    The rates change only when a flow starts or ends, the simulator jumps from one event to the next.
+
+    For every topology, cost protocol and seed the simulator reports the completion time of every flow, the peak and
+    mean utilization of every link between switches and the imbalance of the load across the links, in a json file.
+
+    Usage: python3 ryu_controller/simulator.py [--topology ring_topology ...] [--protocol HOP ...] [--seed 1 2 3] [--output file]
+'''
+import argparse
+import heapq
+import json
+import math
+import random
+import time
+
+from ryu.controller import ofp_event
+from ryu.lib.packet import in_proto
+from utils import get_file_path, costants
+from benchmark import Topology, create_controller, release_controller, answer_barriers, _packet_in, _l4_packet, _percentile, PROTOCOLS
+import main
+
+#Relative tolerance used to decide that a link is saturated or a flow has been completely sent
+EPSILON = 1e-9
+
+#Clock of the controller, it follows the simulated time
+class SimClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def time(self):
+        return self.now
+
+class Flow:
+    __slots__ = ('index', 'type', 'src_host', 'dst_host', 'src', 'dst', 'src_port', 'dst_port', 'size', 'start', 'demand',
+                 'remaining', 'rate', 'links', 'finish', 'connection')
+
+    def __init__(self, index, entry, src, dst, start, demand):
+        self.index = index
+        self.type = entry['type']
+        self.src_host = entry['src_host']
+        self.dst_host = entry['dst_host']
+        self.src = src              #(mac, ip, dpid, port) of the source host
+        self.dst = dst
+        self.src_port = entry['src_port']
+        self.dst_port = entry['dst_port']
+        self.size = int(entry['data_size']) * 8     #bits
+        self.start = start
+        self.demand = demand        #max rate in bits per second, None if the flow takes all the bandwidth it can get
+        self.remaining = self.size
+        self.rate = 0.0
+        self.links = None           #links of the path, None if the flow has not been routed
+        self.finish = None
+        self.connection = None
+
+    @property
+    def proto(self):
+        return in_proto.IPPROTO_TCP if self.type == 'TCP' else in_proto.IPPROTO_UDP
+
+#Max-min fair rates of the flows: the rates of all the flows grow together until a link is saturated or a flow
+#reaches its demand, then those flows are frozen and the others keep growing
+def max_min_rates(flows, capacity):
+    unfrozen = dict()   #link -> number of unfrozen flows using it
+    for flow in flows:
+        flow.rate = 0.0
+        for link in flow.links:
+            unfrozen[link] = unfrozen.get(link, 0) + 1
+    remaining = {link: float(capacity[link]) for link in unfrozen}
+
+    active = set(flows)
+    while active:
+        increment = min(remaining[link] / count for link, count in unfrozen.items() if count > 0)
+        for flow in active:
+            if flow.demand is not None:
+                increment = min(increment, flow.demand - flow.rate)
+        increment = max(increment, 0.0)
+
+        for flow in active:
+            flow.rate += increment
+        for link, count in unfrozen.items():
+            remaining[link] -= increment * count
+
+        frozen = [flow for flow in active if (flow.demand is not None and flow.rate >= flow.demand * (1 - EPSILON))
+                  or any(remaining[link] <= capacity[link] * EPSILON for link in flow.links)]
+        if not frozen:
+            break   #rounding errors, every flow has already got its share
+        for flow in frozen:
+            active.discard(flow)
+            for link in flow.links:
+                unfrozen[link] -= 1
+
+class Simulator:
+    def __init__(self, folder, protocol, seed, udp_rate, arrival_interval):
+        random.seed(seed)   #random choices of the path selection policies
+        self.clock = SimClock()
+        main.time = self.clock
+        self.topology = Topology(folder)
+        self.controller = create_controller(self.topology, protocol)
+
+        #directed links: (src dpid, dst dpid) between switches, ('up', mac) and ('down', mac) for the hosts
+        self.capacity = dict(self.topology.bandwidth)
+        for mac, bandwidth in self.topology.host_bandwidth.items():
+            self.capacity[('up', mac)] = bandwidth
+            self.capacity[('down', mac)] = bandwidth
+        self.bytes = dict.fromkeys(self.capacity, 0.0)      #bytes sent on the link, reported in the port statistics
+        self.busy = dict.fromkeys(self.capacity, 0.0)       #bits sent on the link
+        self.peak = dict.fromkeys(self.capacity, 0.0)       #peak utilization (0-1)
+        self.users = dict()     #id(connection) -> [connection, active flows, time the last flow ended]
+        self.expiries = list()  #heap of (time, sequence number, connection)
+        self.sequence = 0
+
+        with open(get_file_path(__file__, "../config/{}/traffic.json".format(folder)), 'r') as file:
+            traffic = json.load(file)['traffic']
+        self.flows = list()
+        for entry in traffic:
+            #flows with a duration instead of a size are not simulated
+            if entry['type'] == 'ARP' or 'data_size' not in entry:
+                continue
+            src = self.topology.host_names[entry['src_host']]
+            dst = self.topology.host_names[entry['dst_host']]
+            demand = udp_rate if entry['type'] == 'UDP' else None
+            start = float(entry.get('start', 0)) + len(self.flows) * arrival_interval
+            self.flows.append(Flow(len(self.flows), entry, src, dst, start, demand))
+
+    def _find(self, flow):
+        fields = self.controller._rule_fields(flow.proto, flow.src[1], flow.dst[1], flow.src_port, flow.dst_port)
+        return self.controller.connections.find(*fields)
+
+    #Follow the rules of the controller from the source host to the destination host. A packet in is sent to every
+    #switch of the path that has no rule for the flow. Returns the links of the path, None if there is no route
+    def _route(self, flow):
+        controller = self.controller
+        data = _l4_packet(flow.src, flow.dst, flow.proto, flow.src_port, flow.dst_port)
+        dpid, in_port = flow.src[2], flow.src[3]
+        links = [('up', flow.src[0])]
+        for _ in range(len(self.topology.datapaths) + 1):
+            connection, reverse = self._find(flow)
+            if connection is None or (dpid, reverse) not in connection.installed:
+                controller.packet_in_handler(_packet_in(self.topology.datapaths[dpid], in_port, data))
+                answer_barriers(controller, self.topology)
+                connection, reverse = self._find(flow)
+            port = connection.next_hop(dpid, reverse) if connection is not None else None
+            if port is None:
+                return None
+            flow.connection = connection
+
+            peer = controller.port_peers.get((dpid, port))
+            if peer is None:
+                #host port: the packet leaves the network
+                if (dpid, port) != (flow.dst[2], flow.dst[3]):
+                    return None
+                links.append(('down', flow.dst[0]))
+                return links
+            links.append((dpid, peer))
+            in_port = controller.net[peer][dpid]['port']
+            dpid = peer
+        return None     #forwarding loop
+
+    def _advance(self, flows, duration):
+        if duration <= 0:
+            return
+        load = dict()
+        for flow in flows:
+            flow.remaining -= flow.rate * duration
+            for link in flow.links:
+                load[link] = load.get(link, 0.0) + flow.rate
+        for link, rate in load.items():
+            self.bytes[link] += rate * duration / 8
+            self.busy[link] += rate * duration
+            self.peak[link] = max(self.peak[link], rate / self.capacity[link])
+
+    #Port statistics of every switch, as the stats monitor would request them
+    def _send_port_stats(self):
+        ports = dict()
+        for src, src_port, dst, dst_port in self.topology.links:
+            ports.setdefault(src, list()).append((src_port, dst))
+        for dpid, datapath in self.topology.datapaths.items():
+            parser = datapath.ofproto_parser
+            body = list()
+            for port_no, peer in ports.get(dpid, []):
+                body.append(parser.OFPPortStats(port_no=port_no, rx_packets=0, tx_packets=0,
+                    rx_bytes=int(self.bytes[(peer, dpid)]), tx_bytes=int(self.bytes[(dpid, peer)]),
+                    rx_dropped=0, tx_dropped=0, rx_errors=0, tx_errors=0, rx_frame_err=0, rx_over_err=0,
+                    rx_crc_err=0, collisions=0, duration_sec=int(self.clock.now), duration_nsec=0))
+            reply = parser.OFPPortStatsReply(datapath)
+            reply.body = body
+            self.controller.flow_stats_reply_handler(ofp_event.EventOFPPortStatsReply(reply))
+
+    def _acquire(self, connection):
+        entry = self.users.setdefault(id(connection), [connection, 0, None])
+        entry[1] += 1
+
+    #The rules of a connection expire connection_idle_timeout seconds after its last flow has ended
+    def _release(self, connection):
+        entry = self.users[id(connection)]
+        entry[1] -= 1
+        if entry[1] == 0 and costants['connection_idle_timeout'] > 0:
+            entry[2] = self.clock.now
+            self.sequence += 1
+            heapq.heappush(self.expiries, (self.clock.now + costants['connection_idle_timeout'], self.sequence, connection))
+
+    def _expire(self, connection):
+        entry = self.users.get(id(connection))
+        if entry is None or entry[1] > 0 or self.clock.now < entry[2] + costants['connection_idle_timeout']:
+            return  #the connection has been used again
+        del self.users[id(connection)]
+        for dpid, reverse in list(connection.installed):
+            datapath = self.topology.datapaths[dpid]
+            parser = datapath.ofproto_parser
+            if reverse:
+                fields = (connection.proto, connection.dst_ip, connection.src_ip, connection.dst_port, connection.src_port)
+            else:
+                fields = (connection.proto, connection.src_ip, connection.dst_ip, connection.src_port, connection.dst_port)
+            msg = parser.OFPFlowRemoved(datapath, cookie=main.CONNECTION_COOKIE, priority=1000,
+                reason=datapath.ofproto.OFPRR_IDLE_TIMEOUT, table_id=0, duration_sec=0, duration_nsec=0,
+                idle_timeout=costants['connection_idle_timeout'], hard_timeout=0, packet_count=0, byte_count=0,
+                match=self.controller._connection_match(parser, *fields))
+            self.controller.flow_removed_handler(ofp_event.EventOFPFlowRemoved(msg))
+
+    def run(self):
+        pending = sorted(self.flows, key=lambda flow: flow.start)
+        next_arrival = 0
+        active = list()
+        stats_interval = costants['stats_poll_interval']
+        next_stats = stats_interval
+        now = 0.0
+
+        while next_arrival < len(pending) or active:
+            max_min_rates(active, self.capacity)
+
+            arrival = pending[next_arrival].start if next_arrival < len(pending) else math.inf
+            completion = min((now + flow.remaining / flow.rate for flow in active if flow.rate > 0), default=math.inf)
+            expiry = self.expiries[0][0] if self.expiries else math.inf
+            if arrival == math.inf and completion == math.inf:
+                break   #the active flows cannot make progress
+            now_next = min(arrival, completion, next_stats, expiry)
+
+            self._advance(active, now_next - now)
+            now = now_next
+            self.clock.now = now
+
+            #the second condition avoids a zero length step when the time left is below the resolution of the clock
+            finished = [flow for flow in active if flow.remaining <= flow.size * EPSILON
+                        or (flow.rate > 0 and now + flow.remaining / flow.rate <= now)]
+            for flow in finished:
+                active.remove(flow)
+                flow.finish = now
+                self._release(flow.connection)
+
+            while self.expiries and self.expiries[0][0] <= now:
+                self._expire(heapq.heappop(self.expiries)[2])
+
+            if now >= next_stats:
+                self._send_port_stats()
+                next_stats += stats_interval
+
+            while next_arrival < len(pending) and pending[next_arrival].start <= now:
+                flow = pending[next_arrival]
+                next_arrival += 1
+                flow.links = self._route(flow)
+                if flow.links is not None:
+                    self._acquire(flow.connection)
+                    active.append(flow)
+
+        release_controller(self.controller)
+        return self._report(now)
+
+    def _report(self, duration):
+        completion_times = sorted(flow.finish - flow.start for flow in self.flows if flow.finish is not None)
+        flows = list()
+        for flow in self.flows:
+            flows.append({
+                'src_host': flow.src_host, 'dst_host': flow.dst_host, 'type': flow.type,
+                'src_port': flow.src_port, 'dst_port': flow.dst_port, 'data_size': flow.size // 8,
+                'start': flow.start, 'finish': flow.finish,
+                'completion_time': flow.finish - flow.start if flow.finish is not None else None,
+                'path': [flow.src[2]] + [link[1] for link in flow.links[1:-1]] if flow.links is not None else None,
+            })
+
+        links = list()
+        utilizations = list()
+        for link in sorted(self.topology.bandwidth.keys()):
+            mean = self.busy[link] / (self.capacity[link] * duration) if duration > 0 else 0.0
+            utilizations.append(mean)
+            links.append({'src': link[0], 'dst': link[1], 'bandwidth': self.capacity[link],
+                          'peak_utilization': self.peak[link], 'mean_utilization': mean})
+
+        average = sum(utilizations) / len(utilizations) if utilizations else 0.0
+        deviation = math.sqrt(sum((value - average) ** 2 for value in utilizations) / len(utilizations)) if utilizations else 0.0
+        summary = {
+            'flows': len(self.flows),
+            'completed': len(completion_times),
+            'unrouted': sum(1 for flow in self.flows if flow.links is None),
+            'makespan': duration,
+            'completion_time_mean': sum(completion_times) / len(completion_times) if completion_times else None,
+            'completion_time_p50': _percentile(completion_times, 50) if completion_times else None,
+            'completion_time_p99': _percentile(completion_times, 99) if completion_times else None,
+            'peak_link_utilization': max((link['peak_utilization'] for link in links), default=0.0),
+            #imbalance of the mean utilization of the links between switches: max/mean and coefficient of variation
+            'imbalance_max_over_mean': max(utilizations) / average if average > 0 else 0.0,
+            'imbalance_cv': deviation / average if average > 0 else 0.0,
+        }
+        return {'summary': summary, 'flows': flows, 'links': links}
+
+def main_simulator():
+    parser = argparse.ArgumentParser(description='Flow level simulation of the routes chosen by the controller')
+    parser.add_argument('--topology', nargs='*', default=[costants['topology_folder_location']], help='topology folders in config/')
+    parser.add_argument('--protocol', nargs='*', default=PROTOCOLS, choices=PROTOCOLS)
+    parser.add_argument('--seed', nargs='*', type=int, default=[1])
+    parser.add_argument('--udp-rate', type=float, default=1e6, help='rate of the UDP flows in bits per second')
+    parser.add_argument('--arrival-interval', type=float, default=0.0, help='seconds between the start of consecutive flows')
+    parser.add_argument('--summary-only', action='store_true', help='do not write the flows and the links of every run')
+    parser.add_argument('--output', default=get_file_path(__file__, '../simulation_results.json'))
+    args = parser.parse_args()
+
+    results = list()
+    for folder in args.topology:
+        for protocol in args.protocol:
+            for seed in args.seed:
+                start = time.perf_counter()
+                report = Simulator(folder, protocol, seed, args.udp_rate, args.arrival_interval).run()
+                summary = report['summary']
+                print("{:<20} {:<18} seed {:<4} flows {:>5}  mean FCT {:>9}  peak util {:>6.2f}  imbalance {:>6.2f}  ({:.2f} s)".format(
+                    folder, protocol, seed, summary['completed'],
+                    "{:.3f} s".format(summary['completion_time_mean']) if summary['completion_time_mean'] is not None else '-',
+                    summary['peak_link_utilization'], summary['imbalance_max_over_mean'], time.perf_counter() - start))
+                result = {'topology': folder, 'cost_protocol': protocol, 'seed': seed}
+                result.update({'summary': summary} if args.summary_only else report)
+                results.append(result)
+
+    settings = {key: costants[key] for key in ('path_install_mode', 'rule_granularity', 'path_selection', 'utilization_estimator', 'stats_poll_interval')}
+    settings.update({'udp_rate': args.udp_rate, 'arrival_interval': args.arrival_interval})
+    with open(args.output, 'w') as file:
+        json.dump({'settings': settings, 'results': results}, file, indent=4)
+    print("Results written to {}".format(args.output))
+
+if __name__ == '__main__':
+    main_simulator()
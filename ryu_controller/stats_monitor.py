@@ -1,29 +1,65 @@
 from ryu.base import app_manager
 from ryu.controller import ofp_event
-from ryu.controller.handler import CONFIG_DISPATCHER
+from ryu.controller.handler import CONFIG_DISPATCHER, MAIN_DISPATCHER, DEAD_DISPATCHER
 from ryu.controller.handler import set_ev_cls
 from ryu.ofproto import ofproto_v1_3
 from ryu.lib import hub
-from utils import print_debug,print_error
+from utils import print_debug,print_error,hot_log,costants
+import heapq
+import time
 
+'''
+    Statistics monitor:
+
+    The port descriptions (nominal speed of the ports) are requested only when a switch connects and when one of its
+    ports changes.
+    The port statistics are polled with a per-switch interval that adapts to the load of the switch: switches whose
+    links are near saturation are polled every stats_poll_min_interval seconds, idle switches every
+    stats_poll_max_interval seconds. New switches are spread over the polling interval, so the replies do not reach
+    the controller all at the same moment.
+'''
 class ControllerStatsMonitor(app_manager.RyuApp):
     OFP_VERSIONS = [ofproto_v1_3.OFP_VERSION]
 
+    #phase step used to spread the switches over the polling interval (golden ratio, fills the gaps evenly)
+    PHASE_STEP = 0.6180339887
+
     def __init__(self, *args, **kwargs):
         super(ControllerStatsMonitor, self).__init__(*args, **kwargs)
-        self.datapaths = set()
+        self.datapaths = dict() #dpid -> datapath
+        self.schedule = list()  #heap of (next poll time, dpid)
+        self.next_poll = dict() #dpid -> next poll time, used to skip stale entries of the heap
+        self.joined = 0
         self.monitor_thread = hub.spawn(self._monitor)
-        self.sleep = 2
 
     @set_ev_cls(ofp_event.EventOFPSwitchFeatures, CONFIG_DISPATCHER)
     def switch_default_features_handler(self, ev):
-        print_debug("Detected switch with datapath id: {}".format(ev.msg.datapath.id))
+        datapath = ev.msg.datapath
+        print_debug("Detected switch with datapath id: {}".format(datapath.id))
+
+        self.datapaths[datapath.id] = datapath
+        #the nominal speed of the ports does not change, it is requested only now and when a port changes
+        self.request_speed_stats(datapath)
+
+        #spread the first poll of the switches over the polling interval
+        phase = (self.joined * self.PHASE_STEP) % 1.0
+        self.joined += 1
+        self._schedule(datapath.id, time.time() + phase * costants['stats_poll_interval'])
+
+    @set_ev_cls(ofp_event.EventOFPStateChange, DEAD_DISPATCHER)
+    def switch_disconnected_handler(self, ev):
+        datapath = ev.datapath
+        if datapath.id is not None and self.datapaths.get(datapath.id) is datapath:
+            print_debug("Switch with datapath id {} disconnected".format(datapath.id))
+            del self.datapaths[datapath.id]
+            self.next_poll.pop(datapath.id, None)
+
+    @set_ev_cls(ofp_event.EventOFPPortStatus, MAIN_DISPATCHER)
+    def port_status_handler(self, ev):
+        self.request_speed_stats(ev.msg.datapath)
 
-        #send link discovery request
-        self.datapaths.add(ev.msg.datapath)
-    
     def request_stats(self, datapath):
-        print_debug("Requesting stats from switch with datapath id: {}".format(datapath.id))
+        hot_log.debug("Requesting stats from switch with datapath id: {}",datapath.id)
         ofproto = datapath.ofproto
         parser = datapath.ofproto_parser
 
@@ -35,17 +71,49 @@ class ControllerStatsMonitor(app_manager.RyuApp):
 
         req = parser.OFPPortDescStatsRequest(datapath, 0)
         datapath.send_msg(req)
-        
+
+    def _schedule(self, dpid, when):
+        self.next_poll[dpid] = when
+        heapq.heappush(self.schedule, (when, dpid))
+
+    #Polling interval of a switch: the busier its links, the shorter the interval
+    def poll_interval(self, dpid):
+        controller = app_manager.lookup_service_brick('RyuController')
+        if controller is None:
+            return costants['stats_poll_interval']
+
+        utilization = controller.switch_utilization(dpid)
+        idle = costants['stats_poll_idle_threshold']
+        busy = costants['stats_poll_busy_threshold']
+        if utilization <= idle:
+            return costants['stats_poll_max_interval']
+        if utilization >= busy:
+            return costants['stats_poll_min_interval']
+        #linear between the max interval (idle) and the min interval (busy)
+        ratio = (utilization - idle) / (busy - idle)
+        return costants['stats_poll_max_interval'] - ratio * (costants['stats_poll_max_interval'] - costants['stats_poll_min_interval'])
+
     def _monitor(self):
         try:
             while True:
-                for dp in self.datapaths:
-                    self.request_stats(dp)
-                    self.request_speed_stats(dp)
-                if len(self.datapaths) > 0:
-                    hub.sleep(self.sleep)
-                else:
+                if len(self.schedule) == 0:
                     hub.sleep(1)
+                    continue
+
+                when, dpid = self.schedule[0]
+                now = time.time()
+                if when > now:
+                    #wake up at least every second, a new switch may need an earlier poll
+                    hub.sleep(min(when - now, 1))
+                    continue
+
+                heapq.heappop(self.schedule)
+                if self.next_poll.get(dpid) != when or dpid not in self.datapaths:
+                    continue    #stale entry
+
+                self.request_stats(self.datapaths[dpid])
+                #keep the phase of the switch: the next poll is relative to the scheduled time, not to now
+                self._schedule(dpid, max(when + self.poll_interval(dpid), now))
         except Exception as e:
             print_error("Received exception {} in monitor thread".format(str(e)))
             print_error("Exiting...")
@@ -1,5 +1,8 @@
 import os
+import sys
 import json 
+import logging
+from async_log import AsyncLogSink, SinkHandler, SampledLogger, LazyFormat
 
 # Get the path of the file
 def get_file_path(file, file_name):
@@ -25,33 +28,72 @@ def load_costants():
 
 costants = load_costants()
 
-def print_debug(message):
-    if costants['debug']:
-        print("{}  {}DEBUG: {}{}".format(costants['debug_emote'],costants['ansi_yellow'],message,costants['ansi_white']))
+#Records of the console and of the log file, written by a separate thread (see async_log.py)
+log_sink = AsyncLogSink(costants['log_queue_size'])
 
-def print_error(message):
-    print("{}  {}ERROR: {}{}".format(costants['error_emote'],costants['ansi_red'],message,costants['ansi_white']))
+def _console_logger():
+    logger = logging.getLogger('console')
+    logger.propagate = False
+    logger.setLevel(logging.DEBUG if costants['debug'] else logging.INFO)
+    logger.addHandler(SinkHandler(log_sink))
 
+    handler = logging.StreamHandler(sys.stdout)
+    handler.setFormatter(logging.Formatter('%(message)s'))
+    handler.addFilter(logging.Filter('console'))
+    log_sink.add_handler(handler)
+    return logger
 
-def print_path(path,src,dst):
-    reverse = False
-    #check if path is in reverse order
-    for i in range(len(path)-1):
-        if path[i] == src:
-            break
-        if path[i] == dst:
-            reverse = True
-            break
+console = _console_logger()
+#Sampled debug channel of the packet in path
+hot_log = SampledLogger(console, costants['log_sample_rate'])
 
-    copy = path.copy()
-    if reverse:
-        copy.reverse()
-    
-    color = costants['ansi_green']
+#Write the records of the root logger (and of the loggers of the apps) to the log file
+def setup_file_log(file_name, level):
+    handler = logging.FileHandler(file_name)
+    handler.setFormatter(logging.Formatter('%(asctime)s - %(levelname)s - %(message)s'))
+    handler.addFilter(lambda record: not record.name.startswith('console'))
+    log_sink.add_handler(handler)
 
-    for i in range(len(copy)-1):
-        print("{} {} {}-> ".format(color, copy[i], costants['ansi_white']),end='')
-        if copy[i] == src: 
-            color = costants['ansi_yellow']
+    root_logger = logging.getLogger()
+    root_logger.handlers = [SinkHandler(log_sink)]
+    root_logger.setLevel(level)
+    return handler
 
-    print("{} {} {}".format(color,copy[-1],costants['ansi_white']))
\ No newline at end of file
+def print_debug(message, *args):
+    console.debug(LazyFormat(message, args, "{}  {}DEBUG: ".format(costants['debug_emote'],costants['ansi_yellow']), costants['ansi_white']))
+
+def print_error(message, *args):
+    console.error(LazyFormat(message, args, "{}  {}ERROR: ".format(costants['error_emote'],costants['ansi_red']), costants['ansi_white']))
+
+#Colored path from src to dst, built only when the message is written
+class PathText:
+    __slots__ = ('path', 'src', 'dst')
+
+    def __init__(self, path, src, dst):
+        self.path = path
+        self.src = src
+        self.dst = dst
+
+    def __str__(self):
+        path, src, dst = self.path, self.src, self.dst
+        reverse = False
+        #check if path is in reverse order
+        for i in range(len(path)-1):
+            if path[i] == src:
+                break
+            if path[i] == dst:
+                reverse = True
+                break
+
+        copy = list(path)
+        if reverse:
+            copy.reverse()
+
+        color = costants['ansi_green']
+        text = ''
+        for i in range(len(copy)-1):
+            text += "{} {} {}-> ".format(color, copy[i], costants['ansi_white'])
+            if copy[i] == src:
+                color = costants['ansi_yellow']
+
+        return text + "{} {} {}".format(color,copy[-1],costants['ansi_white'])